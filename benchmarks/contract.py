@@ -0,0 +1,82 @@
+"""Compare graphs.contract_graph with the search from each kept node that it replaced.
+
+Run from the top of the repository with: python -m benchmarks.contract"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import random
+import time
+
+from clidigraph import graphs
+
+from . import generators
+
+
+def contract_by_search(graph, kept_nodes):
+    "The previous contract_graph: a search through removed nodes from every kept node"
+    result = graphs.Graph(edges={}, nodes=set())
+    index = graphs.indexed(graph)
+    starts = index.forward.starts
+    ends = index.forward.ends
+    targets = index.forward.targets
+
+    kept_nodes = kept_nodes & set(graph["nodes"])
+    kept = index.bitmap(kept_nodes)
+
+    for node in kept_nodes:
+        result['nodes'].add(node)
+        found = set()
+
+        for label, neighbour in graph['edges'].get(node, []):
+            if neighbour in kept_nodes:
+                result['edges'].setdefault(node, []).append((label, neighbour))
+                found.add(index.ids[neighbour])
+
+        start = index.ids[node]
+        visited = bytearray(len(index.names))
+        visited[start] = 1
+        border = [start]
+        while border:
+            new_border = []
+            for base in border:
+                for target in targets[starts[base]:ends[base]]:
+                    if kept[target]:
+                        if target not in found:
+                            found.add(target)
+                            result['edges'].setdefault(node, []).append((graphs.IMPLICIT, index.names[target]))
+                    elif not visited[target]:
+                        visited[target] = 1
+                        new_border.append(target)
+            border = new_border
+    return result
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def normal_form(graph):
+    return sorted(graph['nodes']), sorted((source, sorted(edges)) for source, edges in graph['edges'].items())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=20000, help='Number of nodes')
+    parser.add_argument('--degree', type=int, default=2, help='Edges from each node')
+    parser.add_argument('--kept', type=int, action='append', help='Numbers of kept nodes to time')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    graph = generators.random_graph(args.size, args.seed, args.degree)
+    graphs.indexed(graph)
+    print('{:>8} {:>12} {:>12}'.format('kept', 'search (s)', 'contract (s)'))
+    for count in args.kept or [100, 300, 1000, 3000]:
+        kept = set(random.Random(count).sample(graph['nodes'], count))
+        expected, search_seconds = timed(contract_by_search, graph, kept)
+        result, seconds = timed(graphs.contract_graph, graph, kept)
+        if normal_form(result) != normal_form(expected):
+            raise Exception('Results differ for {} kept nodes'.format(count))
+        print('{:>8} {:>12.3f} {:>12.3f}'.format(count, search_seconds, seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Seeded generators of graph data for benchmarks.
+
+Each generator takes a number of nodes and a seed and returns the same data
+for the same arguments. Nodes are named n0, n1, ... A few nodes are tagged
+'sampled' so that every graph can be queried by tag."""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import collections
+import random
+
+from clidigraph import datastore, graphs
+
+# With the sampled tag and a group, few enough to be given colors when rendered
+TAGS = ('alpha', 'beta', 'gamma', 'delta')
+
+SAMPLED_TAG = 'sampled'
+
+
+def node_names(size):
+    return ['n{}'.format(i) for i in range(size)]
+
+def graph_data(nodes, edges, generator, sampled=0.01):
+    "Data for a graph, with a fraction sampled of its nodes tagged"
+    data = datastore.GraphData(nodes=nodes, edges=edges, node_info=dict(), tags=dict(), settings=dict())
+    tag_nodes(data, [SAMPLED_TAG], sampled, generator)
+    return data
+
+def tag_nodes(data, tags, fraction, generator):
+    "Give a fraction of the nodes in data some of tags, and a note to some of those"
+    for tag in tags:
+        data['tags'].setdefault(tag, list())
+    for node in generator.sample(data['nodes'], int(len(data['nodes']) * fraction)):
+        info = data['node_info'].setdefault(node, dict())
+        info.setdefault('tags', list()).extend(
+            tag for tag in generator.sample(tags, generator.randint(1, len(tags)))
+            if tag not in info['tags'])
+        if generator.random() < 0.1:
+            info['note'] = 'Note for {}'.format(node)
+
+def chain(size, seed):
+    "Each node has an edge to the next: the longest possible paths"
+    nodes = node_names(size)
+    edges = {source: {(graphs.DEFAULT, target): None} for source, target in zip(nodes, nodes[1:])}
+    return graph_data(nodes, edges, random.Random(seed))
+
+def wide_dag(size, seed, degree=2):
+    "Layers of nodes as wide as the graph is deep, with edges from each layer to the next"
+    generator = random.Random(seed)
+    nodes = node_names(size)
+    width = max(1, int(size ** 0.5))
+    edges = dict()
+    for start in range(0, size - width, width):
+        layer = nodes[start + width:start + 2 * width]
+        for source in nodes[start:start + width]:
+            edges[source] = dict.fromkeys(
+                (graphs.DEFAULT, target) for target in generator.sample(layer, min(degree, len(layer))))
+    return graph_data(nodes, edges, generator)
+
+def random_graph(size, seed, degree=2):
+    "Edges between nodes chosen at random, so with many cycles. Some edges are labelled"
+    generator = random.Random(seed)
+    nodes = node_names(size)
+    edges = dict()
+    for source in nodes:
+        edges[source] = dict.fromkeys(
+            (generator.choice((graphs.DEFAULT, graphs.DEFAULT, 'depends')), generator.choice(nodes))
+            for _ in range(degree))
+    return graph_data(nodes, edges, generator)
+
+def tagged_graph(size, seed):
+    "A random graph where half the nodes have tags"
+    data = random_graph(size, seed)
+    tag_nodes(data, TAGS, 0.5, random.Random(seed))
+    return data
+
+GENERATORS = collections.OrderedDict([
+    ('chain', chain),
+    ('wide-dag', wide_dag),
+    ('random', random_graph),
+    ('tagged', tagged_graph),
+])
@@ -0,0 +1,63 @@
+"""Time show with many independent specifiers, evaluated in one process and
+with --jobs, on generated graphs.
+
+Run from the top of the repository with: python -m benchmarks.parallel"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import contextlib
+import os
+import statistics
+import time
+
+from clidigraph import clidigraph
+
+from . import generators
+
+JOBS = (1, 2, 4)
+
+
+def show_arguments(data, terms):
+    "Arguments for show highlighting nodes around terms nodes spread through data"
+    nodes = data['nodes']
+    seeds = ['raw:' + nodes[i * len(nodes) // terms] for i in range(terms)]
+    return (
+        ['--highlight', ','.join('strict-after:' + seed for seed in seeds)]
+        + ['--highlight', ','.join('strict-before:' + seed for seed in seeds)]
+        + ['--group', 'between', ','.join('between:{}::{}'.format(a, b) for a, b in zip(seeds, seeds[1:]))])
+
+def show_time(data, arguments, jobs, repeat):
+    "The median time taken by show"
+    args = clidigraph.build_parser('show').parse_args(['show', '--jobs', str(jobs)] + arguments)
+    times = []
+    for _ in range(repeat):
+        data.changed()
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            clidigraph.show(args, data)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000, help='Number of nodes in the graph')
+    parser.add_argument('--graph', choices=list(generators.GENERATORS), default='random', help='Kind of generated graph')
+    parser.add_argument('--terms', type=int, default=8, help='Number of nodes to search from')
+    parser.add_argument('--jobs', type=int, action='append', help='Processes to use, can be repeated (default: {})'.format(
+        ', '.join(map(str, JOBS))))
+    parser.add_argument('--repeat', type=int, default=3, help='Times to run each benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data = generators.GENERATORS[args.graph](args.size, args.seed)
+    arguments = show_arguments(data, args.terms)
+    print('{:>6} {:>12} {:>8}'.format('jobs', 'median (s)', 'speedup'))
+    sequential = None
+    for jobs in args.jobs or JOBS:
+        seconds = show_time(data, arguments, jobs, args.repeat)
+        sequential = sequential or seconds
+        print('{:>6} {:>12.4f} {:>7.2f}x'.format(jobs, seconds, sequential / seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Time how long commands take to start, run and exit on an empty graph.
+
+Shell completions and hooks run clidigraph often so startup should stay
+under the budget. Exits with status 1 if the median time of a command is over it.
+
+Run from the top of the repository with: python -m benchmarks.startup"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BUDGET = 0.050
+
+COMMANDS = (['nodes'], ['tags'], ['show'])
+
+
+def run_time(command):
+    start = time.perf_counter()
+    subprocess.check_call(command, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def median_time(command, runs):
+    return statistics.median(run_time(command) for _ in range(runs))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=20, help='Times to run each command')
+    parser.add_argument('--budget', type=float, default=BUDGET, help='Seconds allowed for each command')
+    args = parser.parse_args()
+
+    config_dir = tempfile.mkdtemp()
+    clidigraph = [sys.executable, '-m', 'clidigraph', '--config-dir', config_dir, '--no-server']
+    # Create the graph so that each run only reads it
+    subprocess.check_call(clidigraph + ['nodes'])
+
+    print('{:>12} {:>10}'.format('command', 'median (s)'))
+    print('{:>12} {:>10.3f}'.format('(python)', median_time([sys.executable, '-c', 'pass'], args.runs)))
+    over_budget = False
+    for command in COMMANDS:
+        seconds = median_time(clidigraph + command, args.runs)
+        over_budget = over_budget or seconds > args.budget
+        print('{:>12} {:>10.3f}'.format(' '.join(command), seconds))
+
+    shutil.rmtree(config_dir)
+
+    if over_budget:
+        print('Over the budget of {:.3f}s'.format(args.budget))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""Time loading and saving, each specifier, each show option and rendering
+on generated graphs. Results are written as json so that runs can be compared.
+
+Run from the top of the repository with: python -m benchmarks.suite
+Compare with an earlier run with: python -m benchmarks.suite --compare old.json"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import collections
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from clidigraph import clidigraph, datastore, render, specifiers
+
+from . import generators
+
+SIZES = (1000, 10000, 100000)
+
+
+def specifier_examples(data):
+    "An example of each kind of specifier for data"
+    nodes = data['nodes']
+    middle = 'raw:' + nodes[len(nodes) // 2]
+    early = 'raw:' + nodes[len(nodes) // 4]
+    tag = 'tag:' + generators.SAMPLED_TAG
+    return collections.OrderedDict([
+        ('raw', middle),
+        ('regex', 'n1.*5$'),
+        ('after', 'after:' + middle),
+        ('before', 'before:' + middle),
+        ('between', 'between:{}::{}'.format(early, middle)),
+        ('neighbour', 'neighbour:2:' + middle),
+        ('not', 'not:' + tag),
+        ('root', 'root:'),
+        ('strict-after', 'strict-after:' + middle),
+        ('strict-before', 'strict-before:' + middle),
+        ('tag', tag),
+        ('union', '{},after:{}'.format(tag, middle)),
+    ])
+
+def show_examples(data):
+    "Arguments for show that use each of its options"
+    nodes = data['nodes']
+    middle = 'raw:' + nodes[len(nodes) // 2]
+    early = 'raw:' + nodes[len(nodes) // 4]
+    tag = 'tag:' + generators.SAMPLED_TAG
+    return collections.OrderedDict([
+        ('all', []),
+        ('after', ['--after', middle]),
+        ('before', ['--before', middle]),
+        ('around', ['--around', middle]),
+        ('between', ['--between', early, middle]),
+        ('neighbours', ['--neighbours', middle, '2']),
+        ('nodes', ['--nodes', tag]),
+        ('after-all', ['--nodes', tag, '--after-all']),
+        ('highlight', ['--highlight', tag]),
+        ('group', ['--group', 'group', tag]),
+        ('contract', ['--contract', tag]),
+        ('no-label', ['--no-label', 'depends']),
+        ('cut', ['--cut', 'to:' + tag]),
+        ('explain', ['--after', middle, '--explain']),
+    ])
+
+def storage_benchmarks(data, directory):
+    "(name, function) pairs timing saving and loading data in each type of storage"
+    json_file = os.path.join(directory, 'graph')
+    sqlite_file = os.path.join(directory, 'graph.sqlite')
+
+    def load_json():
+        os.unlink(json_file + '.cache')
+        datastore.JsonStore(json_file).read()
+
+    def load_sqlite():
+        loaded = datastore.SqliteStore(sqlite_file).read()
+        list(loaded['nodes'])
+        dict(loaded['edges'])
+
+    return [
+        ('save json', lambda: datastore.JsonStore(json_file).write(data)),
+        ('load json', load_json),
+        ('load json cached', lambda: datastore.JsonStore(json_file).read()),
+        ('save sqlite', lambda: datastore.SqliteStore(sqlite_file).write(data)),
+        ('load sqlite', load_sqlite),
+    ]
+
+def graph_benchmarks(data):
+    "(name, function) pairs timing queries of data"
+    examples = specifier_examples(data)
+    missing = set(specifiers.SpecifierMatch.specifiers()) - set(examples)
+    if missing:
+        raise Exception('No example of specifiers {}'.format(sorted(missing)))
+
+    parser = clidigraph.build_parser('show')
+    result = []
+    for kind, specifier in examples.items():
+        result.append(('specifier ' + kind, lambda specifier=specifier: specifiers.get_matching_nodes(data, data, specifier)))
+    for option, arguments in show_examples(data).items():
+        args = parser.parse_args(['show'] + arguments)
+        result.append(('show ' + option, lambda args=args: clidigraph.show(args, data)))
+    result.append(('render', lambda: render.render_graph(data, data, [], dict())))
+    return result
+
+def time_function(function, data, repeat):
+    "Times for each run of function. Indexes are dropped before each run so each starts from the data alone"
+    times = []
+    for _ in range(repeat):
+        data.changed()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+def run(generator_names, sizes, repeat, seed, selected):
+    for size in sizes:
+        for generator_name in generator_names:
+            data = generators.GENERATORS[generator_name](size, seed)
+            directory = tempfile.mkdtemp()
+            try:
+                for name, function in storage_benchmarks(data, directory) + graph_benchmarks(data):
+                    if selected and not any(word in name for word in selected):
+                        continue
+                    # show and explain write to stdout and stderr
+                    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null), contextlib.redirect_stderr(null):
+                        times = time_function(function, data, repeat)
+                    yield dict(
+                        benchmark=name, graph=generator_name, size=size,
+                        seconds=times, median=statistics.median(times), min=min(times))
+            finally:
+                shutil.rmtree(directory)
+
+def result_key(result):
+    return (result['benchmark'], result['graph'], result['size'])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--size', type=int, action='append', dest='sizes',
+        help='Number of nodes in each graph, can be repeated (default: {})'.format(', '.join(map(str, SIZES))))
+    parser.add_argument(
+        '--graph', choices=list(generators.GENERATORS), action='append', dest='graphs',
+        help='Kind of generated graph, can be repeated (default: all)')
+    parser.add_argument(
+        'benchmarks', nargs='*',
+        help='Only run benchmarks with names containing one of these, such as "specifier" or "load"')
+    parser.add_argument('--repeat', type=int, default=3, help='Times to run each benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', '-o', default='benchmark-results.json', help='File to write results to')
+    parser.add_argument('--compare', metavar='FILE', help='Results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    previous = dict()
+    if args.compare:
+        with open(args.compare) as stream:
+            previous = {result_key(result): result for result in json.load(stream)['results']}
+
+    results = []
+    print('{:<24} {:<10} {:>8} {:>12} {:>10}'.format(
+        'benchmark', 'graph', 'size', 'median (s)', 'change' if previous else ''))
+    for result in run(args.graphs or list(generators.GENERATORS), args.sizes or SIZES, args.repeat, args.seed, args.benchmarks):
+        results.append(result)
+        change = ''
+        if result_key(result) in previous:
+            change = '{:+.0%}'.format(result['median'] / previous[result_key(result)]['median'] - 1)
+        print('{:<24} {:<10} {:>8} {:>12.4f} {:>10}'.format(
+            result['benchmark'], result['graph'], result['size'], result['median'], change))
+        sys.stdout.flush()
+
+    with open(args.output, 'w') as stream:
+        json.dump(dict(
+            python=platform.python_version(), platform=platform.platform(),
+            time=time.time(), repeat=args.repeat, seed=args.seed,
+            results=results), stream, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import sys
+
+from .clidigraph import main
+
+sys.exit(main())
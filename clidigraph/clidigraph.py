@@ -6,20 +6,15 @@ from __future__ import (absolute_import, division, print_function,
 import argparse
 import collections
 import contextlib
+import io
 import json
 import logging
 import os
-import re
-import subprocess
+import shlex
 import sys
-import threading
+import time
 
-import fasteners
-import graphviz
-
-import editor
-
-from . import graphs, specifiers, datastore, render
+from . import graphs, specifiers, datastore, journal, locks, render, timings, trigger
 
 if sys.version_info[0] != 3:
     # FileNotFoundError does not exist in python 2
@@ -29,183 +24,332 @@ if sys.version_info[0] != 3:
 LOGGER = logging.getLogger()
 
 
-def build_parser(): # pylint: disable=too-many-locals,too-many-locals,too-many-statements
-    parser = argparse.ArgumentParser(description='Maintain a labelled digraph')
+def add_global_arguments(parser):
     parser.add_argument('--debug', action='store_true', help='Include debug output (to stderr)')
     parser.add_argument('--config-dir', type=str, default=os.path.join(os.environ['HOME'], '.config', 'clidigraph'))
     parser.add_argument('--graph', type=str, default='graph')
-    parsers = parser.add_subparsers(dest='command')
+    parser.add_argument(
+        '--no-server', action='store_true', default=False,
+        help='Run in this process even if a server is running for the graph')
+    parser.add_argument(
+        '--timings', action='store_true', default=False,
+        help='Write how long each phase of the command took, and the sizes of graphs, to stderr')
+    parser.add_argument(
+        '--profile', metavar='FILE', type=str,
+        help='Write cProfile statistics for the command to FILE. Runs in this process')
+
+# Destinations of the global arguments, which do not change the output of a command
+GLOBAL_OPTIONS = ('debug', 'config_dir', 'graph', 'no_server', 'timings', 'profile')
+
+def find_command(argv=None):
+    "The command in a command line, or None if there is not one or the line is invalid"
+    parser = argparse.ArgumentParser(add_help=False, exit_on_error=False)
+    add_global_arguments(parser)
+    parser.add_argument('command', nargs='?')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER)
+    try:
+        args, unknown = parser.parse_known_args(argv)
+    except argparse.ArgumentError:
+        return None
+    # Options before the command that are not understood here, like --help
+    if unknown:
+        return None
+    return args.command if args.command in COMMANDS else None
+
+def build_parser(command=None):
+    """The parser for command lines running command. Parsers for other commands
+    are only built, which is slow, if command is None"""
+    parser = argparse.ArgumentParser(description='Maintain a labelled digraph')
+    add_global_arguments(parser)
+    if command is None:
+        parsers = parser.add_subparsers(dest='command')
+    else:
+        # Usage lists every command even though only one parser is built
+        parsers = parser.add_subparsers(dest='command', metavar='{' + ','.join(COMMANDS) + '}')
+    for name, (kwargs, add_arguments) in COMMANDS.items():
+        if command is None or name == command:
+            command_parser = parsers.add_parser(name, **kwargs)
+            if add_arguments is not None:
+                add_arguments(command_parser)
+    return parser
 
-    tags_parser = parsers.add_parser('tags', help='Show tags')
-    tags_parser.add_argument('specifier', type=str, nargs='?', help='For these nodes')
+def tags_arguments(parser):
+    parser.add_argument('specifier', type=str, nargs='?', help='For these nodes')
 
-    nodes_parser = parsers.add_parser('nodes', help='Show nodes')
-    nodes_parser.add_argument('specifier', type=str, nargs='?')
+def nodes_arguments(parser):
+    parser.add_argument('specifier', type=str, nargs='?')
 
-    nodes_parser.add_argument('--tag', '-t', type=str, help='Output nodes with these  tags', action='append')
+    parser.add_argument('--tag', '-t', type=str, help='Output nodes with these  tags', action='append')
 
-    remove_parser = parsers.add_parser('nonode')
-    remove_parser.add_argument('node', action='append', type=str)
+def nonode_arguments(parser):
+    parser.add_argument('node', action='append', type=str)
 
-    tag_parser = parsers.add_parser('tag', help='Tag a node')
-    tag_parser.add_argument('node', type=str)
-    tag_parser.add_argument('tag', type=str)
-    tag_parser.add_argument('--new', '-n', action='store_true', help='Create a new tag')
+def tag_arguments(parser):
+    parser.add_argument('node', type=str)
+    parser.add_argument('tag', type=str)
+    parser.add_argument('--new', '-n', action='store_true', help='Create a new tag')
 
-    tag_parser = parsers.add_parser('move-tag', help='Move one tag to another')
-    tag_parser.add_argument('source', type=str)
-    tag_parser.add_argument('target', type=str)
+def move_tag_arguments(parser):
+    parser.add_argument('source', type=str)
+    parser.add_argument('target', type=str)
 
-    tag_parser = parsers.add_parser('untag', help='Remove a tag from a node')
-    tag_parser.add_argument('specifier', type=str)
-    tag_parser.add_argument('tag', type=str)
+def untag_arguments(parser):
+    parser.add_argument('specifier', type=str)
+    parser.add_argument('tag', type=str)
 
-    notag_parser = parsers.add_parser('notag', help='Delete a tag')
-    notag_parser.add_argument('tag', type=str)
+def notag_arguments(parser):
+    parser.add_argument('tag', type=str)
 
-    parsers.add_parser('trigger', help='Run the trigger event')
-    parsers.add_parser('dump', help='Dump the data (liable to change)')
-    parsers.add_parser('shell', help='Open a python shell to edit data')
+def batch_arguments(parser):
+    parser.add_argument('file', type=str, nargs='?', default='-', help='File of commands (default: stdin)')
 
-    show_parser = parsers.add_parser('show', help='Show all nodes')
-    show_parser.add_argument(
+def import_arguments(parser):
+    from . import edgelist
+    parser.add_argument('file', type=str, nargs='?', default='-', help='File to read (default: stdin)')
+    parser.add_argument(
+        '--format', '-f', choices=edgelist.FORMATS,
+        help='Format of the file (default: from its extension, otherwise tsv)')
+
+def export_arguments(parser):
+    from . import edgelist
+    parser.add_argument('file', type=str, nargs='?', default='-', help='File to write (default: stdout)')
+    parser.add_argument(
+        '--format', '-f', choices=edgelist.FORMATS,
+        help='Format of the file (default: from its extension, otherwise tsv)')
+
+def cache_arguments(parser):
+    parser.add_argument('action', choices=['clear', 'stats'])
+
+def migrate_arguments(parser):
+    parser.add_argument('storage', choices=['json', 'journal', 'sqlite'])
+
+def show_arguments(parser):
+    parser.add_argument(
         '--collapse', '-c', type=str, action='append',
         metavar='specifier',
         help='Get rid of these nodes, but keep implied edges')
-    show_parser.add_argument(
+    parser.add_argument(
         '--around', '-r', type=str, action='append',
         help='Show nodes both before and after this.'
         ' Use tag:TAGNAME to show all nodes with a tag')
-    show_parser.add_argument(
+    parser.add_argument(
         '--before', '-b', type=str, action='append',
         help='Show nodes that lead to this node.'
         ' Use tag:TAGNAME to show all nodes with a tag')
-    show_parser.add_argument(
+    parser.add_argument(
         '--after', '-a', type=str, action='append',
         help='Show the nodes that can be reached from these nodes', )
-    show_parser.add_argument(
+    parser.add_argument(
         '--after-all', '-A', action='store_true',
         help='Add descendants to all selected node.')
-    show_parser.add_argument(
+    parser.add_argument(
         '--between', '-B', type=str,
         action='append', nargs=2,
         metavar=('FROM', 'TWO'),
         help='Include nodes between these two specifiers')
-    show_parser.add_argument(
+    parser.add_argument(
         '--neighbours', '-n', type=str,
         action='append', nargs=2,
         metavar=('NODE', 'DEPTH'),
         help='Show node and neighbours up to a depth of DEPTH.'
         ' If depth is signed +2 or -2 then show parents or children')
-    show_parser.add_argument(
+    parser.add_argument(
         '--highlight', '-H', action='append',
         type=str, help='Highlight nodes matching this specifier')
-    show_parser.add_argument(
+    parser.add_argument(
         '--group', '-G', action='append',
         type=str, metavar=('name', 'selector'), help='Place these node in a group. And color them the same color', nargs=2)
-    show_parser.add_argument(
+    parser.add_argument(
         '--contract', '-C', type=str, action='append',
         metavar='selector_list',
         help='Place these node in a group. And color them the same color')
-    show_parser.add_argument(
+    parser.add_argument(
         '--nodes', '-N', type=str, action='append',
         metavar='selector',
         help='Include items matching this selector')
-    show_parser.add_argument(
+    parser.add_argument(
         '--no-label', type=str, action='append',
         help='Exclude these labels from the graph')
-    show_parser.add_argument(
+    parser.add_argument(
         '--cut', type=str, action='append',
         help='Exclude these edges from a graph')
-
-    config_parser = parsers.add_parser('config', help='Change settings')
-    action = config_parser.add_mutually_exclusive_group(required=True)
+    parser.add_argument(
+        '--explain', action='store_true', default=False,
+        help='Write how specifiers were evaluated, with timings, to stderr')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=1,
+        help='Evaluate specifiers in up to this many processes at once')
+    parser.add_argument(
+        '--watch', action='store_true', default=False,
+        help='Keep running, writing the graph again each time the output changes')
+
+def config_arguments(parser):
+    action = parser.add_mutually_exclusive_group(required=True)
     action.add_argument('--list', action='store_true', default=False)
     action.add_argument('--set', type=str, default=False, nargs=2)
 
-    rename_parser = parsers.add_parser('rename', help='Rename a node')
-    rename_parser.add_argument('old', type=str)
-    rename_parser.add_argument('new', type=str)
+def rename_arguments(parser):
+    parser.add_argument('old', type=str)
+    parser.add_argument('new', type=str)
 
-    info_parser = parsers.add_parser('info', help='Show information for a node')
-    info_parser.add_argument('node_selector', type=str)
+def info_arguments(parser):
+    parser.add_argument('node_selector', type=str)
 
-    node_parser = parsers.add_parser('node', help='Add a node')
-    node_parser.add_argument('name', type=str, nargs='+')
-    node_parser.add_argument(
+def node_arguments(parser):
+    parser.add_argument('name', type=str, nargs='+')
+    parser.add_argument(
         '--tag', '-T', type=str,
         help='Mark the node with this tag')
-    node_parser.add_argument(
+    parser.add_argument(
         '--from', '-f', type=str, action='append', dest='from_nodes',
         help='Add a link from this node')
-    node_parser.add_argument(
+    parser.add_argument(
         '--to', '-t', type=str, action='append', dest='to_nodes',
         help='Add a link to this node')
-    node_parser.add_argument(
+    parser.add_argument(
         '--label', '-l', type=str, default=graphs.DEFAULT,
         help='Mark edges with this label')
 
-    label_parser = parsers.add_parser('label', help='Label an existing edge')
-    label_parser.add_argument('source', type=str)
-    label_parser.add_argument('target', type=str)
-    label_parser.add_argument('label', type=str)
-
-    edge_parser = parsers.add_parser('edge', help='Add an edge')
-    edge_parser.add_argument('source', type=str)
-    edge_parser.add_argument('target', type=str)
-    edge_parser.add_argument('label', type=str, default=graphs.DEFAULT, nargs='?')
-
-    specifiers_parser = parsers.add_parser('specifiers', help='Output nodes specifiers')
-
-    notes_parser = parsers.add_parser('note', help='Change the node associates with an entry')
-    notes_parser.add_argument('node_selector', type=str)
-    notes_parser.add_argument('note', type=str, nargs='?')
-    notes_parser.add_argument(
+def label_arguments(parser):
+    parser.add_argument('source', type=str)
+    parser.add_argument('target', type=str)
+    parser.add_argument('label', type=str)
+    parser.add_argument(
+        '--old-label', '-o', type=str,
+        help='The label of the edge to change. Needed if there is more than one edge from source to target')
+
+def edge_arguments(parser):
+    parser.add_argument('source', type=str)
+    parser.add_argument('target', type=str)
+    parser.add_argument('label', type=str, default=graphs.DEFAULT, nargs='?')
+
+def note_arguments(parser):
+    parser.add_argument('node_selector', type=str)
+    parser.add_argument('note', type=str, nargs='?')
+    parser.add_argument(
         '--edit', action='store_true', default=False,
         help='Edit value with an editor')
 
-    no_edge = parsers.add_parser('noedge', help='Remove an edge')
-    no_edge.add_argument('source', type=str)
-    no_edge.add_argument('target', type=str)
-    no_edge.add_argument('label', type=str, default=graphs.DEFAULT, nargs='?')
-
-    return parser
-
-
-def read_json(filename):
-    if os.path.exists(filename):
-        with open(filename) as stream:
-            return json.loads(stream.read())
+def noedge_arguments(parser):
+    parser.add_argument('source', type=str)
+    parser.add_argument('target', type=str)
+    parser.add_argument('label', type=str, default=graphs.DEFAULT, nargs='?')
+
+# command -> (keyword arguments for its parser, function adding its arguments), in the order shown by --help
+COMMANDS = collections.OrderedDict([
+    ('tags', (dict(help='Show tags'), tags_arguments)),
+    ('nodes', (dict(help='Show nodes'), nodes_arguments)),
+    ('nonode', (dict(), nonode_arguments)),
+    ('tag', (dict(help='Tag a node'), tag_arguments)),
+    ('move-tag', (dict(help='Move one tag to another'), move_tag_arguments)),
+    ('untag', (dict(help='Remove a tag from a node'), untag_arguments)),
+    ('notag', (dict(help='Delete a tag'), notag_arguments)),
+    ('trigger', (dict(help='Run the trigger event'), None)),
+    ('batch', (dict(
+        help='Run commands read from a file, one per line, saving once and triggering once.'
+        ' Nothing is saved if a command fails'), batch_arguments)),
+    ('import', (dict(
+        help='Add the nodes and edges in an edge list that are not already in the graph'), import_arguments)),
+    ('export', (dict(help='Write all nodes and edges as an edge list'), export_arguments)),
+    ('dump', (dict(help='Dump the data (liable to change)'), None)),
+    ('shell', (dict(help='Open a python shell to edit data'), None)),
+    ('compact', (dict(help='Fold the journal into the json file'), None)),
+    ('migrate', (dict(help='Convert the graph to another type of storage'), migrate_arguments)),
+    ('cache', (dict(help='Clear the cache of show output, or show how much it holds'), cache_arguments)),
+    ('serve', (dict(
+        help='Keep the graph loaded and answer commands over a unix socket.'
+        ' Other invocations use the server while it is running'), None)),
+    ('show', (dict(help='Show all nodes'), show_arguments)),
+    ('config', (dict(help='Change settings'), config_arguments)),
+    ('rename', (dict(help='Rename a node'), rename_arguments)),
+    ('info', (dict(help='Show information for a node'), info_arguments)),
+    ('node', (dict(help='Add a node'), node_arguments)),
+    ('label', (dict(help='Label an existing edge'), label_arguments)),
+    ('edge', (dict(help='Add an edge'), edge_arguments)),
+    ('specifiers', (dict(help='Output nodes specifiers'), None)),
+    ('note', (dict(help='Change the node associates with an entry'), note_arguments)),
+    ('noedge', (dict(help='Remove an edge'), noedge_arguments)),
+])
+
+
+# Threads in one process share inter-process locks so also need a lock of their own
+DATA_LOCK = locks.ReaderWriterLock()
+def data_locks(data_file, write):
+    "The locks to take, in order, to read or write data_file"
+    file_lock = locks.InterProcessReaderWriterLock(data_file + '.lck')
+    if write:
+        return (file_lock.write_lock(), DATA_LOCK.write_lock())
     else:
-        return dict()
+        return (file_lock.read_lock(), DATA_LOCK.read_lock())
 
-DATA_LOCK = threading.Lock()
 @contextlib.contextmanager
-def with_data(data_file):
-    "Read from a json file, write back to it when we are finished"
-    with fasteners.InterProcessLock(data_file + '.lck'):
-        with DATA_LOCK:
-            data = read_json(data_file)
+def with_data(data_file, write=True):
+    """Read data from the store for data_file, save changes to it when we are finished.
+
+    Readers share the lock and run in parallel. Writers take it exclusively"""
+    with contextlib.ExitStack() as stack:
+        with timings.phase('lock'):
+            for lock in data_locks(data_file, write):
+                stack.enter_context(lock)
+        with timings.phase('load') as phase:
+            store = datastore.open_store(data_file)
+            data = read_resident_data(store)
+            if not isinstance(data, datastore.SqliteGraphData):
+                # Counting a database would read all of it
+                phase.graph(data)
+        try:
             yield data
+        except:
+            # The data may be half-modified: read it again next time
+            if data_file in RESIDENT:
+                keep_resident(data_file)
+            raise
+
+        with timings.phase('save'):
+            moved = write and store.save(data)
+        if not write:
+            # Commands that change the data leave indexes to be saved by the next query
+            with timings.phase('save indexes'):
+                datastore.save_indexes(store, data)
+
+        if write and data_file in RESIDENT:
+            if moved:
+                keep_resident(data_file)
+            else:
+                RESIDENT[data_file] = (store.signature(), data)
+
+# Data kept in memory between commands by a server
+#   data_file -> (signature, data)
+RESIDENT = dict()
+
+def keep_resident(data_file):
+    RESIDENT[data_file] = (None, None)
 
-            output = json.dumps(data)
-            with open(data_file, 'w') as stream:
-                stream.write(output)
+def read_resident_data(store):
+    if store.data_file not in RESIDENT:
+        return store.read()
 
+    signature, data = RESIDENT[store.data_file]
+    current_signature = store.signature()
+    if data is None or signature != current_signature:
+        LOGGER.debug('Loading %r', store.data_file)
+        data = store.read()
+        RESIDENT[store.data_file] = (current_signature, data)
+    return data
 
 
 def empty_graph():
-    return dict(nodes=list(), edges={})
+    return graphs.Graph(nodes=list(), edges={})
 
 def root_graph(data):
-    return dict(nodes=data['nodes'], edges=data['edges'])
+    return graphs.Graph(nodes=data['nodes'], edges=data['edges'])
 
 
-DEFAULT_SETTINGS = dict(trigger=None)
+DEFAULT_SETTINGS = dict(trigger=None, storage='json')
 
-def main(): # pylint: disable=too-many-branches
-    parser = build_parser()
-    args = parser.parse_args()
+def main(argv=None):
+    parser = build_parser(find_command(argv))
+    args = parser.parse_args(argv)
 
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
@@ -213,87 +357,260 @@ def main(): # pylint: disable=too-many-branches
     if not os.path.isdir(args.config_dir):
     	os.mkdir(args.config_dir)
 
-    data_file = os.path.join(args.config_dir, args.graph)
-
-    if args.command == 'note':
-        note_command(data_file, args)
+    data_file = get_data_file(args)
+
+    if not args.no_server and not runs_locally(args):
+        from . import server
+        status = server.request(data_file, sys.argv[1:] if argv is None else argv)
+        if status is not None:
+            return status
+
+    if args.command == 'serve':
+        return serve_command(data_file)
+
+    if args.profile:
+        return profile(args.profile, run, parser, args, data_file)
+    return run(parser, args, data_file)
+
+def profile(filename, function, *args):
+    "Run function, writing cProfile statistics to filename"
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(filename)
+
+def get_data_file(args):
+    "The path of the graph, the same for every way of naming it"
+    return os.path.realpath(os.path.join(args.config_dir, args.graph))
+
+def runs_locally(args):
+    "Commands that need a terminal or must not be sent to a server"
+    return (
+        args.command in ('batch', 'export', 'import', 'serve', 'shell')
+        or (args.command == 'note' and args.edit)
+        or (args.command == 'show' and args.watch)
+        or bool(args.profile))
+
+def serve_command(data_file):
+    from . import server
+
+    def run_request(argv, client_data_file):
+        parser = build_parser(find_command(argv))
+        args = parser.parse_args(argv)
+        # Paths in argv are relative to the client's working directory
+        if os.path.realpath(client_data_file) != data_file:
+            raise Exception('This server is for {!r} not {!r}'.format(data_file, client_data_file))
+        if runs_locally(args):
+            raise Exception('{!r} cannot be run by the server'.format(args.command))
+        return run(parser, args, data_file)
+
+    keep_resident(data_file)
+    server.serve(data_file, run_request)
+
+def run(parser, args, data_file):
+    if not args.timings:
+        return run_timed(parser, args, data_file)
+
+    timings.start()
+    start = time.perf_counter()
+    try:
+        return run_timed(parser, args, data_file)
+    finally:
+        timings.report(sys.stderr, timings.stop(), time.perf_counter() - start)
+
+def run_timed(parser, args, data_file):
+    if args.command == 'batch':
+        with timings.phase('read batch'):
+            args.batch = read_batch(args, data_file)
+
+    if args.command == 'show' and args.watch:
+        return watch_command(args, data_file)
+
+    if args.command == 'show' and not args.explain:
+        with timings.phase('query cache'):
+            output = cached_show(data_file, args)
+        if output is not None:
+            sys.stdout.write(output)
+            return
+
+    if args.command == 'note' and args.edit:
+        settings, changes = note_edit_command(data_file, args)
     else:
-        with with_clidi_data(data_file) as data:
+        with with_clidi_data(data_file, write=modifies_data(args)) as data:
+            settings = data['settings']
             for key, value in DEFAULT_SETTINGS.items():
                 data['settings'].setdefault(key, value)
-            if args.command == 'dump':
-                print(json.dumps(data, indent=4))
-            elif args.command == 'shell':
-                shell_command(data)
-            elif args.command == 'config':
-                config_command(args, data)
-            elif args.command == 'specifiers':
-                for x in specifiers.SpecifierMatch.specifiers():
-                    print(x)
-            elif args.command == 'edge':
-                add_edge(data, args.source, args.target, args.label)
-            elif args.command == 'label':
-                label_edge(data, args.source, args.target, args.label or graphs.DEFAULT)
-            elif args.command == 'noedge':
-                source = specifiers.get_node(data, args.source)
-                target = specifiers.get_node(data, args.target)
-                data['edges'][source].remove([args.label, target])
-            elif args.command == 'show':
-                show(args, data)
-            elif args.command == 'nonode':
-                delete_node_command(args, data)
-            elif args.command == 'rename':
-                return rename_command(data, args.old, args.new)
-            elif args.command == 'node':
-                create_node(
-                    data,
-                    args)
-            elif args.command == 'tag':
-                add_tag_command(data, args)
-            elif args.command == 'move-tag':
-                move_tag_command(data, args)
-            elif args.command == 'untag':
-                untag_command(data, args)
-            elif args.command == 'notag':
-                delete_tag_command(data, args)
-            elif args.command == 'nodes':
-                list_node_command(args, data)
-            elif args.command == 'tags':
-                if args.specifier is None:
-                    for tag in sorted(data['tags']):
-                        print(tag)
-                else:
-                    result = set()
-                    for node in specifiers.get_matching_nodes(data, data, args.specifier):
-                        tags = data['node_info'][node].get('tags', [])
-                        result.update(tags)
-                    for tag in sorted(result):
-                        print(tag)
-            elif args.command == 'trigger':
-                pass
-            elif args.command == 'info':
-                show_node_info_command(data, args)
-            elif args.command == None:
-                parser.print_help()
-            else:
-                raise ValueError(args.command)
-
-    with with_clidi_data(data_file) as data:
-        if args.command is not None and TRIGGERS_CHANGE[args.command]:
-            LOGGER.debug('Triggering change')
-            if data['settings'].get('trigger'):
-                subprocess.check_call(data['settings']['trigger'], shell=True)
+            with timings.phase(args.command or 'help'):
+                run_command(parser, args, data_file, data)
+            # Running the trigger by hand is for changes that were not recorded
+            changes = recorded_changes(data) if args.command != 'trigger' else None
+
+    if triggers_change(args):
+        LOGGER.debug('Triggering change')
+        if settings.get('trigger'):
+            with timings.phase('trigger'):
+                trigger.run_trigger(data_file, settings, changes)
+
+def recorded_changes(data):
+    "The changes made to data before it is saved, or None if they were not recorded"
+    return None if data.changes is None else list(data.changes)
+
+def run_command(parser, args, data_file, data): # pylint: disable=too-many-branches
+    if args.command == 'dump':
+        print(json.dumps(datastore.json_data(data), indent=4, default=datastore.to_json))
+    elif args.command == 'shell':
+        shell_command(data)
+    elif args.command == 'config':
+        config_command(args, data)
+    elif args.command == 'specifiers':
+        for x in specifiers.SpecifierMatch.specifiers():
+            print(x)
+    elif args.command == 'edge':
+        add_edge(data, args.source, args.target, args.label)
+    elif args.command == 'label':
+        label_edge(data, args.source, args.target, args.label or graphs.DEFAULT, args.old_label)
+    elif args.command == 'noedge':
+        source = specifiers.get_node(data, args.source)
+        target = specifiers.get_node(data, args.target)
+        if not datastore.has_edge(data, source, args.label, target):
+            raise Exception('There is no {} edge from {} to {}'.format(args.label, source, target))
+        datastore.remove_edge(data, source, args.label, target)
+    elif args.command == 'show':
+        show_command(args, data_file, data)
+    elif args.command == 'compact':
+        compact_command(data_file, data)
+    elif args.command == 'migrate':
+        migrate_command(args, data)
+    elif args.command == 'cache':
+        cache_command(args, data_file, data)
+    elif args.command == 'nonode':
+        delete_node_command(args, data)
+    elif args.command == 'rename':
+        rename_command(data, args.old, args.new)
+    elif args.command == 'node':
+        create_node(
+            data,
+            args)
+    elif args.command == 'tag':
+        add_tag_command(data, args)
+    elif args.command == 'move-tag':
+        move_tag_command(data, args)
+    elif args.command == 'untag':
+        untag_command(data, args)
+    elif args.command == 'notag':
+        delete_tag_command(data, args)
+    elif args.command == 'nodes':
+        list_node_command(args, data)
+    elif args.command == 'tags':
+        if args.specifier is None:
+            for tag in sorted(data['tags']):
+                print(tag)
+        else:
+            result = set()
+            for node in specifiers.get_matching_nodes(data, data, args.specifier):
+                tags = data['node_info'][node].get('tags', [])
+                result.update(tags)
+            for tag in sorted(result):
+                print(tag)
+    elif args.command == 'trigger':
+        pass
+    elif args.command == 'info':
+        show_node_info_command(data, args)
+    elif args.command == 'note':
+        note_command(data, args)
+    elif args.command == 'batch':
+        batch_command(parser, args, data_file, data)
+    elif args.command == 'import':
+        import_command(args, data)
+    elif args.command == 'export':
+        export_command(args, data)
+    elif args.command == None:
+        parser.print_help()
+    else:
+        raise ValueError(args.command)
+
+def modifies_data(args):
+    "Whether a command may change the data (and so needs to write it)"
+    if args.command == 'config':
+        return not args.list
+    elif args.command == 'batch':
+        return any(modifies_data(line_args) for _, line_args in args.batch)
+    return args.command not in READ_ONLY_COMMANDS
+
+def triggers_change(args):
+    if args.command == 'batch':
+        return any(triggers_change(line_args) for _, line_args in args.batch)
+    return args.command is not None and TRIGGERS_CHANGE[args.command]
+
+def read_batch(args, data_file):
+    "The commands in a batch file as (line number, arguments) pairs"
+    if args.file == '-':
+        lines = list(sys.stdin)
+    else:
+        with open(args.file) as stream:
+            lines = list(stream)
+
+    result = []
+    for number, line in enumerate(lines, 1):
+        words = shlex.split(line, comments=True)
+        if not words:
+            continue
+        # Lines use the options given to batch unless they give their own
+        line_args = build_parser(find_command(words)).parse_args(words, namespace=argparse.Namespace(
+            debug=args.debug, config_dir=args.config_dir, graph=args.graph, no_server=args.no_server))
+        if get_data_file(line_args) != data_file:
+            raise Exception('Line {}: commands in a batch must be for {!r}'.format(number, data_file))
+        if line_args.command is None or line_args.command == 'batch' or runs_locally(line_args):
+            raise Exception('Line {}: {!r} cannot be run in a batch'.format(number, line_args.command))
+        result.append((number, line_args))
+    return result
+
+def batch_command(parser, args, data_file, data):
+    "Run commands one after another. If one fails nothing is saved"
+    for number, line_args in args.batch:
+        try:
+            with timings.phase('line {}: {}'.format(number, line_args.command)):
+                run_command(parser, line_args, data_file, data)
+        except Exception as error:
+            raise Exception('Line {}: {}'.format(number, error)) from error
+
+def import_command(args, data):
+    from . import edgelist
+    file_format = args.format or edgelist.guess_format(args.file)
+    # Without newline='' carriage returns in names would be read as newlines
+    if args.file == '-':
+        stream = open(sys.stdin.fileno(), newline='', closefd=False)
+    else:
+        stream = open(args.file, newline='')
+    with stream:
+        added = edgelist.import_items(data, edgelist.read_items(stream, file_format))
+    LOGGER.debug('Imported %d nodes and %d edges', *added)
+
+def export_command(args, data):
+    from . import edgelist
+    file_format = args.format or edgelist.guess_format(args.file)
+    if args.file == '-':
+        edgelist.write_graph(data, sys.stdout, file_format)
+    else:
+        with open(args.file, 'w', newline='') as stream:
+            edgelist.write_graph(data, stream, file_format)
 
-def note_command(data_file, args):
-    with with_clidi_data(data_file) as data:
-        item = data['node_info'].setdefault(specifiers.get_node(data, args.node_selector), {})
+def note_command(data, args):
+    datastore.set_node_info(data, specifiers.get_node(data, args.node_selector), 'note', args.note)
 
-        if not args.edit:
-            item['note'] = args.note
+def note_edit_command(data_file, args):
+    "Edit a note. Returns the settings and the changes made"
+    # Do not hold a lock while the editor is open
+    with with_clidi_data(data_file, write=False) as data:
+        note = data['node_info'].get(specifiers.get_node(data, args.node_selector), {}).get('note')
 
-    new_value = editor.edit(contents=item.get('note', '').encode('utf8')).decode('utf8')
+    import editor
+    new_value = editor.edit(contents=(note or '').encode('utf8')).decode('utf8')
     with with_clidi_data(data_file) as data:
-        data['node_info'][specifiers.get_node(data, args.node_selector)]['note'] = new_value
+        datastore.set_node_info(data, specifiers.get_node(data, args.node_selector), 'note', new_value)
+        return data['settings'], recorded_changes(data)
 
 def config_command(args, data):
     if args.list:
@@ -301,47 +618,57 @@ def config_command(args, data):
             print(key, item)
     elif args.set:
         key, value = args.set
-        data['settings'][key] = value
+        datastore.set_setting(data, key, value)
 
     else:
         raise Exception('No action')
 
+def compact_command(data_file, data):
+    if os.path.exists(journal.journal_path(data_file)):
+        data.rewrite()
+
+def cache_command(args, data_file, data):
+    from . import querycache
+    cache = querycache.QueryCache(data_file)
+    if args.action == 'clear':
+        cache.clear()
+    else:
+        entries, size = cache.stats()
+        print('entries', entries)
+        print('bytes', size)
+        print('limit', querycache.cache_size(data['settings']))
+
+def migrate_command(args, data):
+    datastore.set_setting(data, 'storage', args.storage)
+    data.rewrite()
+
 def shell_command(data):
     import IPython
     IPython.embed()
     IPython.start_ipython(user_ns=dict(data=data))
+    # Changes made in the shell are not recorded
+    data.rewrite()
 
 def add_tag_command(data, args):
     node = specifiers.get_node(data, args.node)
     if args.new:
         tag = args.tag
-        data["tags"][tag] = list()
+        datastore.create_tag(data, tag)
     else:
         tag = datastore.get_tag(data=data, tag=args.tag)
 
-    data["node_info"].setdefault(node, dict())
-    data["node_info"][node].setdefault('tags', list()).append(tag)
+    datastore.add_node_tag(data, node, tag)
 
 def untag_command(data, args):
     for node in specifiers.get_matching_nodes(data, data, args.specifier):
-        if node in data["node_info"] and 'tags' in data['node_info'][node]:
-            if args.tag in data["node_info"][node]['tags']:
-                data["node_info"][node]['tags'].remove(args.tag)
+        datastore.remove_node_tag(data, node, args.tag)
 
 def move_tag_command(data, args):
-    data['tags'][args.target] = data['tags'].pop(args.source)
-    for v in data["node_info"].values():
-        if 'tags' in v:
-            if args.source in v['tags']:
-                v['tags'].remove(args.source)
-                v['tags'].append(args.source)
+    datastore.rename_tag(data, args.source, args.target)
 
 def delete_tag_command(data, args):
     tag = datastore.get_tag(data=data, tag=args.tag)
-    data['tags'].pop(tag)
-    for v in data["node_info"].values():
-        if tag in v:
-            v.remove(tag)
+    datastore.delete_tag(data, tag)
 
 def show_node_info_command(data, args):
     node = specifiers.get_node(data, args.node_selector)
@@ -357,55 +684,163 @@ def list_node_command(args, data):
     else:
         nodes = specifiers.get_matching_nodes(data, data,  args.specifier)
 
+    if args.tag is not None:
+        tagged = datastore.tagged(data)
+        nodes = set(nodes) & set.union(*(tagged.nodes_with_value(tag) for tag in args.tag))
+
     for node in sorted(nodes):
-        node_tag = data['node_info'].get(node, dict()).get('tag')
-        if args.tag is None or node_tag in args.tag:
-            print(node)
+        print(node)
 
 def delete_node_command(args, data):
     for node in args.node:
-        if node in data['edges']:
-            del data['edges'][node]
-
-        if node in data['nodes']:
-            data['nodes'].remove(node)
-            data['node_info'].pop(node, None)
+        datastore.remove_node(data, node)
+
+def show_key(args):
+    "The arguments that change the output of show"
+    return json.dumps(
+        {key: value for key, value in vars(args).items() if key not in GLOBAL_OPTIONS + ('jobs',)}, sort_keys=True)
+
+def cached_show(data_file, args):
+    "The output of show saved for the current version of the graph, or None"
+    from . import querycache
+    cache = querycache.QueryCache(data_file)
+    if not os.path.isdir(cache.directory):
+        return None
+    with contextlib.ExitStack() as stack:
+        for lock in data_locks(data_file, write=False):
+            stack.enter_context(lock)
+        return cache.get(datastore.open_store(data_file).signature(), ('show', show_key(args)))
+
+def show_command(args, data_file, data):
+    "Show the graph, saving the output and the nodes for each specifier in the query cache"
+    from . import querycache
+    cache = querycache.QueryCache(data_file)
+    size = querycache.cache_size(data['settings'])
+    # The data must be what was read for the version to describe it
+    if args.explain or not size or data.changes != []:
+        if not size:
+            cache.clear()
+        show(args, data)
+        return
+
+    version = datastore.open_store(data_file).signature()
+    query = specifiers.Query(data, cache.get(version, 'specifiers'))
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        show(args, data, query)
+    sys.stdout.write(output.getvalue())
+
+    try:
+        cache.put(version, ('show', show_key(args)), output.getvalue(), size)
+        results = query.data_results()
+        if results.keys() - query.saved.keys():
+            results.update(query.saved)
+            cache.put(version, 'specifiers', results, size)
+    except OSError:
+        LOGGER.debug('Could not write query cache for %r', data_file, exc_info=True)
+
+WATCH_INTERVAL = 0.2
+
+def watch_command(args, data_file):
+    """Write the graph each time the output of show changes, until interrupted.
+
+    Only the parts of show that depend on what changed are recomputed. The graph
+    is read once it has not changed for WATCH_INTERVAL so that bursts of changes
+    are shown once"""
+    data = signature = selection = results = output = None
+    try:
+        while True:
+            with with_clidi_data(data_file, write=False) as new_data:
+                signature = datastore.open_store(data_file).signature()
+                changed = None if data is None else datastore.changed_parts(data, new_data)
+
+                if changed is None or changed & set(['nodes', 'edges', 'tags']):
+                    saved = None if changed is None else specifiers.unchanged_results(results, changed)
+                    query = specifiers.Query(new_data, saved)
+                    selection = select(args, new_data, query)
+                    results = query.data_results()
+                    if args.explain:
+                        query.explain(sys.stderr)
+
+                if changed is None or changed & set(['nodes', 'edges', 'tags', 'node_info']):
+                    new_output = render.render_graph(new_data, *selection)
+                    if new_output != output:
+                        output = new_output
+                        sys.stdout.write(output)
+                        sys.stdout.flush()
+                data = new_data
+
+            wait_for_change(data_file, signature)
+    except KeyboardInterrupt:
+        pass
+
+def wait_for_change(data_file, signature):
+    "Wait until the store for data_file no longer has signature and has not changed for WATCH_INTERVAL"
+    current = signature
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        latest = datastore.open_store(data_file).signature()
+        if latest == current and latest != signature:
+            return
+        current = latest
+
+def show(args, data, query=None):
+    # Shared by all specifiers so that common parts are evaluated once
+    query = query or specifiers.Query(data)
+    graph, highlighted_nodes, grouped_nodes = select(args, data, query)
+
+    with timings.phase('render') as phase:
+        render.write_graph(sys.stdout, data, graph, highlighted_nodes, grouped_nodes)
+        phase.graph(graph)
+
+    if args.explain:
+        query.explain(sys.stderr)
+
+def data_specifiers(args):
+    "The specifiers that show evaluates on the whole graph"
+    result = (args.before or []) + (args.after or []) + (args.around or []) + (args.highlight or []) + (args.contract or [])
+    result.extend(selector for _, selector in args.group or [])
+    # Otherwise these are evaluated on the graph without some edges
+    if not args.no_label and not args.cut:
+        result.extend(specifier for pair in args.between or [] for specifier in pair)
+        result.extend(args.nodes or [])
+        result.extend(specifier for specifier, _ in args.neighbours or [])
+    return result
+
+def select(args, data, query):
+    """The graph to show, the nodes to highlight and the groups of nodes.
+    These depend only on the nodes, edges and tags of data"""
+    if args.jobs > 1:
+        query.evaluate_parallel(data_specifiers(args), args.jobs)
 
-    for graph_node in data['edges']:
-        for pair in list(data['edges'][graph_node]):
-            _, target = pair
-            if target in args.node:
-                data['edges'][graph_node].remove(pair)
-
-def show(args, data):
     before_nodes = args.before and set.union(
         *(
-            specifiers.get_matching_nodes(data, data, spec)
+            specifiers.get_matching_nodes(data, data, spec, query)
             for spec in args.before))
     after_nodes = args.after and set.union(
         *(
-            specifiers.get_matching_nodes(data, data, spec)
+            specifiers.get_matching_nodes(data, data, spec, query)
             for spec in args.after))
 
     if args.around:
         before_nodes = set.union(
             before_nodes or set(),
-            *(specifiers.get_matching_nodes(data, data, spec) for spec in args.around))
+            *(specifiers.get_matching_nodes(data, data, spec, query) for spec in args.around))
         after_nodes = set.union(
             after_nodes or set(),
-            *(specifiers.get_matching_nodes(data, data, spec) for spec in args.around))
+            *(specifiers.get_matching_nodes(data, data, spec, query) for spec in args.around))
 
     if args.group:
         grouped_nodes = collections.OrderedDict()
         for name, selector in args.group:
-            grouped_nodes[name] = specifiers.get_matching_nodes(data, data, selector)
+            grouped_nodes[name] = specifiers.get_matching_nodes(data, data, selector, query)
     else:
         grouped_nodes = dict()
 
 
     if args.highlight:
         highlighted_nodes = set.union(
-            *(specifiers.get_matching_nodes(data, data, spec) for spec in args.highlight))
+            *(specifiers.get_matching_nodes(data, data, spec, query) for spec in args.highlight))
     else:
         highlighted_nodes = []
 
@@ -415,50 +850,64 @@ def show(args, data):
 
     # Edge cutting phase (various operations depend upon edges (contract edge)
     if args.no_label:
-        for label in args.no_label:
-            input_graph = graphs.remove_label(input_graph, label)
+        with timings.phase('no-label') as phase:
+            for label in args.no_label:
+                input_graph = graphs.remove_label(input_graph, label)
+            phase.graph(input_graph)
 
     if args.cut:
-        edges = set()
-        for spec in args.cut:
-            edges |= set(specifiers.get_matching_edges(data, input_graph, spec))
-        input_graph = graphs.remove_edges(input_graph, edges)
+        with timings.phase('cut') as phase:
+            edges = set()
+            for spec in args.cut:
+                edges |= set(specifiers.get_matching_edges(data, input_graph, spec, query))
+            input_graph = graphs.remove_edges(input_graph, edges)
+            phase.graph(input_graph)
 
     if before_nodes is not None:
-        graph = graph or empty_graph()
-        graph = graphs.merge_graphs(graph, *[graphs.before_graph(input_graph, node) for node in before_nodes])
+        with timings.phase('before') as phase:
+            graph = graph or empty_graph()
+            graph = graphs.merge_graphs(graph, graphs.before_graphs(input_graph, before_nodes))
+            phase.graph(graph)
 
     if args.between:
-        graph = graph or empty_graph()
-        for from_spec, to_spec in args.between:
-            from_nodes = specifiers.get_matching_nodes(data, input_graph, from_spec)
-            to_nodes = specifiers.get_matching_nodes(data, input_graph, to_spec)
-            graph = graphs.merge_graphs(graph, graphs.between_graph(input_graph, from_nodes, to_nodes))
+        with timings.phase('between') as phase:
+            graph = graph or empty_graph()
+            for from_spec, to_spec in args.between:
+                from_nodes = specifiers.get_matching_nodes(data, input_graph, from_spec, query)
+                to_nodes = specifiers.get_matching_nodes(data, input_graph, to_spec, query)
+                graph = graphs.merge_graphs(graph, graphs.between_graph(input_graph, from_nodes, to_nodes))
+            phase.graph(graph)
 
     if args.nodes:
-        graph = graph or empty_graph()
-        induction_nodes = set()
-        for spec in args.nodes:
-            induction_nodes |= set(specifiers.get_matching_nodes(data, input_graph, spec))
+        with timings.phase('nodes') as phase:
+            graph = graph or empty_graph()
+            induction_nodes = set()
+            for spec in args.nodes:
+                induction_nodes |= set(specifiers.get_matching_nodes(data, input_graph, spec, query))
 
 
-        graph = graphs.merge_graphs(graph, graphs.induce_graph(input_graph, induction_nodes))
+            graph = graphs.merge_graphs(graph, graphs.induce_graph(input_graph, induction_nodes))
+            phase.graph(graph)
 
 
     if after_nodes is not None:
-        graph = graph or empty_graph()
-        graph = graphs.merge_graphs(graph, *[graphs.after_graph(input_graph, node) for node in after_nodes])
+        with timings.phase('after') as phase:
+            graph = graph or empty_graph()
+            graph = graphs.merge_graphs(graph, graphs.after_graphs(input_graph, after_nodes))
+            phase.graph(graph)
 
     if args.neighbours:
-        for specifier, depth in args.neighbours:
-            graph = graph or empty_graph()
-            seeds = specifiers.get_matching_nodes(data, input_graph, specifier)
-            graph = graphs.merge_graphs(graph, *[
-                specifiers.neighbour_graph(input_graph, seed, depth)
-                for seed in seeds])
+        with timings.phase('neighbours') as phase:
+            for specifier, depth in args.neighbours:
+                graph = graph or empty_graph()
+                seeds = specifiers.get_matching_nodes(data, input_graph, specifier, query)
+                graph = graphs.merge_graphs(graph, specifiers.neighbour_graph(input_graph, seeds, depth))
+            phase.graph(graph)
 
     if args.after_all and graph:
-        graph = graphs.merge_graphs(graph, *[graphs.after_graph(input_graph, node) for node in graph["nodes"]])
+        with timings.phase('after-all') as phase:
+            graph = graphs.merge_graphs(graph, graphs.after_graphs(input_graph, graph["nodes"]))
+            phase.graph(graph)
 
 
     # Show the whole graph if nothing is found
@@ -468,21 +917,23 @@ def show(args, data):
     # Contract phase (edges can change after this)
 
     if args.contract is not None:
-        contraction_sets = (set(specifiers.get_matching_nodes(data, data, spec)) for spec in args.contract)
-        contraction_nodes = set.union(*contraction_sets)
-        LOGGER.debug('Contraction nodes: %r', contraction_nodes)
-        graph = graphs.contract_graph(graph, contraction_nodes)
+        with timings.phase('contract') as phase:
+            contraction_sets = (set(specifiers.get_matching_nodes(data, data, spec, query)) for spec in args.contract)
+            contraction_nodes = set.union(*contraction_sets)
+            LOGGER.debug('Contraction nodes: %r', contraction_nodes)
+            graph = graphs.contract_graph(graph, contraction_nodes)
+            phase.graph(graph)
 
-    print(render.render_graph(data, graph, highlighted_nodes, grouped_nodes))
+    return graph, highlighted_nodes, grouped_nodes
 
 def create_node(data, args):
     for name in args.name:
-        if name in data['nodes']:
+        if name in graphs.names(data):
             raise Exception('Not {!r} already exists'.format(name))
-        data['nodes'].append(name)
+        datastore.add_node(data, name)
 
         if args.tag:
-            data['node_info'].setdefault(name, dict())['tag'] = args.tag
+            datastore.set_node_info(data, name, 'tag', args.tag)
 
         if args.from_nodes:
             for from_node in args.from_nodes:
@@ -493,54 +944,54 @@ def create_node(data, args):
                 add_edge(data, 'raw:' + name, to_node, label=args.label)
 
 def rename_command(data, old, new):
-    old, = [n for n in data['nodes'] if re.search(old, n)]
+    old, = graphs.names(data).search(old)
 
-    if new in data['nodes']:
+    if new in graphs.names(data):
         raise Exception('{!r} is already a node'.format(new))
 
-    old_info = data['node_info'].pop(old, dict())
-    data['nodes'].remove(old)
-    data['nodes'].append(new)
-    if old in data['edges']:
-        data['edges'][new] = data['edges'].pop(old)
-
-    data['node_info'][new] = old_info
-
-    for source in list(data["edges"]):
-        data["edges"][source] = [
-            (label, new if target == old else target)
-            for label, target in data["edges"][source]]
+    datastore.rename_node(data, old, new)
 
 def add_edge(data, source_string, target_string, label=graphs.DEFAULT):
     source = specifiers.get_node(data, source_string)
     target = specifiers.get_node(data, target_string)
-    data['edges'].setdefault(source, [])
-    data['edges'][source].append((label, target))
+    # Nothing changes, and nothing is saved, if the edge is already there
+    if not datastore.has_edge(data, source, label, target):
+        datastore.add_edge(data, source, label, target)
 
-def label_edge(data, source_string, target_string, label):
+def label_edge(data, source_string, target_string, label, old_label=None):
     source = specifiers.get_node(data, source_string)
     target = specifiers.get_node(data, target_string)
 
+    if old_label is None:
+        old_label = edge_label(data, source, target)
+    elif not datastore.has_edge(data, source, old_label, target):
+        raise Exception('No {} edge from {} to {}'.format(old_label, source, target))
+    datastore.remove_edge(data, source, old_label, target)
+    datastore.add_edge(data, source, label, target)
+
+def edge_label(data, source, target):
+    "The label of the only edge from source to target"
     if source not in data['edges']:
         raise Exception('No edges from {}'.format(source))
 
-    edges = []
-    for neighbour_label, neighbour in data['edges'][source]:
-        if neighbour == target:
-            edges.append((source, neighbour_label, target))
+    # Only the shorter of the edges from source and the edges into target are read
+    outgoing = data['edges'][source]
+    incoming = graphs.predecessors(data).get(target, dict())
+    if len(outgoing) <= len(incoming):
+        labels = [edge_label for edge_label, neighbour in outgoing if neighbour == target]
+    else:
+        labels = [edge_label for edge_label, neighbour in incoming if neighbour == source]
 
-    if len(edges) > 1:
-        raise Exception('Too many edges {}'.format(edges))
-    elif len(edges) == 0:
+    if len(labels) > 1:
+        raise Exception('Too many edges {}'.format([(source, edge_label, target) for edge_label in labels]))
+    elif len(labels) == 0:
         raise Exception('Too few edges')
-    else:
-        new_neighbours = [(l, x) for l, x in data['edges'][source] if x != target] + [(label, target)]
-        data['edges'][source] = new_neighbours
+    return labels[0]
 
 
 @contextlib.contextmanager
-def with_clidi_data(data_file):
-    with with_data(data_file) as data:
+def with_clidi_data(data_file, write=True):
+    with with_data(data_file, write=write) as data:
         data.setdefault('tags', dict())
         data.setdefault('edges', dict())
         data.setdefault('nodes', list())
@@ -549,12 +1000,19 @@ def with_clidi_data(data_file):
         yield data
 
 
+READ_ONLY_COMMANDS = set([None, 'cache', 'dump', 'export', 'info', 'nodes', 'serve', 'show', 'specifiers', 'tags', 'trigger'])
+
 TRIGGERS_CHANGE = {
+    'cache': False,
+    'compact': False,
     'config': False,
     'dump': False,
     'edge': True,
+    'export': False,
+    'import': True,
     'info': False,
     'label': True,
+    'migrate': False,
     'node': True,
     'nodes': False,
     'noedge': True,
@@ -562,6 +1020,7 @@ TRIGGERS_CHANGE = {
     'notag': True,
     'note': True,
     'rename': True,
+    'serve': False,
     'shell': True,
     'show': False,
     'tag': True,
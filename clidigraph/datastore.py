@@ -1,5 +1,928 @@
+"""Storing graph data and changing it.
 
+Changes are made through operations which are recorded so that a store
+can save just the changes.
+
+The edges from each node are kept in a dictionary keyed by (label, target)
+with None values: an ordered set, so that edges can be found, added and
+removed in constant time and cannot be repeated. In json they are lists
+of [label, target] pairs."""
+
+import collections.abc
+import contextlib
+import functools
+import gc
+import json
+import logging
+import marshal
+import mmap
+import os
 import re
+import sys
+
+from . import graphs, journal
+
+LOGGER = logging.getLogger('datastore')
+
+OPERATIONS = dict()
+
+# Bytes
+JOURNAL_COMPACT_SIZE = 1024 * 1024
+
+# Change this when the contents of the cache change
+CACHE_VERSION = 2
+
+# Change this when saved indexes change
+INDEX_VERSION = 2
+
+# Indexes that are saved next to the data file: name -> class
+SAVED_INDEXES = dict(reachability=graphs.Reachability)
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+class GraphData(graphs.Graph):
+    "Data for a graph together with the changes made since it was read"
+    def __init__(self, *args, **kwargs):
+        graphs.Graph.__init__(self, *args, **kwargs)
+        # None if the data was changed in a way that was not recorded
+        self.changes = []
+
+    def rewrite(self):
+        "Mark the data as changed in ways that were not recorded"
+        self.changes = None
+        self.changed()
+
+
+# Indexes that every operation keeps up to date
+MAINTAINED_INDEXES = ('predecessors', 'names', 'tagged', 'reachability')
+# Indexes kept by operations that do not change nodes or edges
+NON_STRUCTURAL_INDEXES = ('indexed',) + MAINTAINED_INDEXES
+
+def operation(keep=()):
+    """Decorator for changes to data. Changes are recorded in data.changes.
+
+    Indexes of the data are dropped, except those in keep, which the
+    operation does not affect or keeps up to date"""
+    def decorator(func):
+        OPERATIONS[func.__name__] = func
+
+        @functools.wraps(func)
+        def wrapper(data, *args):
+            func(data, *args)
+            if isinstance(data, GraphData):
+                data.changed(keep=keep)
+                if data.changes is not None:
+                    data.changes.append([func.__name__] + list(args))
+        return wrapper
+    return decorator
+
+def replay(data, changes):
+    "Apply recorded changes to data"
+    for name, *args in changes:
+        OPERATIONS[name](data, *args)
+
+def changed_parts(old, new):
+    "Which of 'nodes', 'edges', 'tags', 'node_info' and 'settings' differ between two versions of data"
+    result = set()
+    if list(old['nodes']) != list(new['nodes']):
+        result.add('nodes')
+    for part in ('edges', 'node_info', 'settings'):
+        if old[part] != new[part]:
+            result.add(part)
+    if old['tags'] != new['tags'] or ('node_info' in result and node_tags(old) != node_tags(new)):
+        result.add('tags')
+    return result
+
+def node_tags(data):
+    return {node: info['tags'] for node, info in data['node_info'].items() if info.get('tags')}
+
+
+@operation(keep=MAINTAINED_INDEXES)
+def add_node(data, name):
+    names = graphs.names(data)
+    data['nodes'].append(name)
+    names.add(name)
+    update_reachability(data, 'add_node', name)
+
+@operation(keep=MAINTAINED_INDEXES)
+def remove_node(data, name):
+    "Remove a node and edges to and from it, in time proportional to its edges"
+    # Indexes are built before the data changes
+    predecessors = graphs.predecessors(data)
+    names = graphs.names(data)
+    index = tagged(data)
+    has_edges = any(
+        other != name
+        for edges in (predecessors.get(name, ()), data['edges'].get(name, ()))
+        for _, other in edges)
+    update_reachability(data, 'remove_node', name, has_edges)
+    for label, source in predecessors.pop(name, dict()):
+        if source != name:
+            del data['edges'][source][(label, name)]
+
+    for label, target in data['edges'].pop(name, dict()):
+        if target != name:
+            del predecessors[target][(label, name)]
+
+    if name in names:
+        data['nodes'].remove(name)
+        names.remove(name)
+    index.remove(name, data['node_info'].pop(name, dict()))
+
+@operation(keep=MAINTAINED_INDEXES)
+def rename_node(data, old, new):
+    # Indexes are built before the data changes
+    index = tagged(data)
+    names = graphs.names(data)
+    predecessors = graphs.predecessors(data)
+    old_info = data['node_info'].pop(old, dict())
+    index.remove(old, old_info)
+    index.add(new, old_info)
+    data['nodes'].remove(old)
+    data['nodes'].append(new)
+    names.remove(old)
+    names.add(new)
+
+    incoming = predecessors.pop(old, dict())
+    for label, source in incoming:
+        if source != old:
+            edges = data['edges'][source]
+            del edges[(label, old)]
+            edges[(label, new)] = None
+
+    outgoing = data['edges'].pop(old, None)
+    if outgoing is not None:
+        data['edges'][new] = dict.fromkeys((label, new if target == old else target) for label, target in outgoing)
+        for label, target in outgoing:
+            if target != old:
+                sources = predecessors[target]
+                del sources[(label, old)]
+                sources[(label, new)] = None
+    if incoming:
+        predecessors[new] = dict.fromkeys((label, new if source == old else source) for label, source in incoming)
+
+    data['node_info'][new] = old_info
+    update_reachability(data, 'rename_node', old, new)
+
+@operation(keep=MAINTAINED_INDEXES)
+def add_edge(data, source, label, target):
+    "Add an edge, unless it is already there"
+    # The index is built before the edges change
+    predecessors = graphs.predecessors(data)
+    data['edges'].setdefault(source, dict())[(label, target)] = None
+    predecessors.setdefault(target, dict())[(label, source)] = None
+    update_reachability(data, 'add_edge', source, target)
+
+@operation(keep=MAINTAINED_INDEXES)
+def remove_edge(data, source, label, target):
+    predecessors = graphs.predecessors(data)
+    del data['edges'][source][(label, target)]
+    del predecessors[target][(label, source)]
+    # Another edge between the nodes leaves what they reach unchanged
+    if not any(other == target for _, other in data['edges'][source]):
+        update_reachability(data, 'remove_edge', source, target)
+
+def update_reachability(data, method, *args):
+    """Keep a reachability index that has been built up to date, or drop
+    it if the change cannot be made to it. A saved index is out of date
+    once the data changes and is built again when it is next needed"""
+    if not isinstance(data, graphs.Graph):
+        return
+    data.loaders.pop('reachability', None)
+    index = data.indexes.get('reachability')
+    if index is not None and not getattr(index, method)(*args):
+        del data.indexes['reachability']
+
+def has_edge(data, source, label, target):
+    return (label, target) in data['edges'].get(source, ())
+
+def keyed_edges(edges):
+    "Edges read from json as lists of [label, target] pairs, keyed by (label, target)"
+    return {source: dict.fromkeys(map(tuple, pairs)) for source, pairs in edges.items()}
+
+def json_data(data):
+    "data with edges as lists of [label, target] pairs, to be written as json"
+    result = dict(data)
+    result['edges'] = {source: list(map(list, edges)) for source, edges in data['edges'].items()}
+    return result
+
+@operation(keep=NON_STRUCTURAL_INDEXES)
+def set_node_info(data, node, key, value):
+    index = tagged(data)
+    info = data['node_info'].setdefault(node, dict())
+    index.remove(node, info)
+    info[key] = value
+    index.add(node, info)
+
+@operation(keep=NON_STRUCTURAL_INDEXES)
+def add_node_tag(data, node, tag):
+    index = tagged(data)
+    tags = data['node_info'].setdefault(node, dict()).setdefault('tags', list())
+    if tag not in tags:
+        tags.append(tag)
+        index.tags.setdefault(tag, set()).add(node)
+
+@operation(keep=NON_STRUCTURAL_INDEXES)
+def remove_node_tag(data, node, tag):
+    index = tagged(data)
+    tags = data['node_info'].get(node, dict()).get('tags', list())
+    if tag in tags:
+        tags.remove(tag)
+        index.tags[tag].discard(node)
+
+@operation(keep=NON_STRUCTURAL_INDEXES)
+def create_tag(data, tag):
+    data['tags'][tag] = list()
+
+@operation(keep=NON_STRUCTURAL_INDEXES)
+def rename_tag(data, old, new):
+    index = tagged(data)
+    data['tags'][new] = data['tags'].pop(old)
+    nodes = index.tags.pop(old, set())
+    for node in nodes:
+        tags = data['node_info'][node]['tags']
+        tags.remove(old)
+        if new not in tags:
+            tags.append(new)
+    if nodes:
+        index.tags.setdefault(new, set()).update(nodes)
+
+@operation(keep=NON_STRUCTURAL_INDEXES)
+def delete_tag(data, tag):
+    index = tagged(data)
+    data['tags'].pop(tag)
+    for node in index.tags.pop(tag, set()):
+        data['node_info'][node]['tags'].remove(tag)
+
+@operation(keep=NON_STRUCTURAL_INDEXES)
+def set_setting(data, key, value):
+    data['settings'][key] = value
+
+
+def tagged(data):
+    "The nodes with each tag"
+    return graphs.get_index(data, 'tagged', tag_index)
+
+def tag_index(data):
+    index = TagIndex(dict(), dict())
+    for node, info in data['node_info'].items():
+        index.add(node, info)
+    return index
+
+
+class TagIndex(object):
+    """Nodes by the tags in their 'tags' list and by the value
+    of their 'tag' (from node --tag)"""
+    def __init__(self, tags, values):
+        # tag -> set of nodes
+        self.tags = tags
+        # value of 'tag' -> set of nodes
+        self.values = values
+
+    def nodes(self, tag):
+        "Nodes with a tag"
+        return self.tags.get(tag, set())
+
+    def nodes_with_value(self, value):
+        "Nodes whose 'tag' is value"
+        return self.values.get(value, set())
+
+    def add(self, node, info):
+        "Index the node info of a node"
+        for tag in info.get('tags', list()):
+            self.tags.setdefault(tag, set()).add(node)
+        if isinstance(info.get('tag'), str):
+            self.values.setdefault(info['tag'], set()).add(node)
+
+    def remove(self, node, info):
+        "Stop indexing the node info of a node"
+        for tag in info.get('tags', list()):
+            self.tags[tag].discard(node)
+        if isinstance(info.get('tag'), str):
+            self.values[info['tag']].discard(node)
+
+
+def open_store(data_file):
+    "The store for a data file, based on what is in the file"
+    if os.path.exists(data_file):
+        with open(data_file, 'rb') as stream:
+            if stream.read(len(SQLITE_HEADER)) == SQLITE_HEADER:
+                return SqliteStore(data_file)
+    return JsonStore(data_file)
+
+def store_for_settings(data_file, settings):
+    "The store that settings ask for"
+    if settings.get('storage') == 'sqlite':
+        return SqliteStore(data_file)
+    return JsonStore(data_file)
+
+def to_json(value):
+    "Convert lazily read data for json.dumps(default=)"
+    if isinstance(value, LazyNodes):
+        return list(value)
+    elif isinstance(value, LazyMapping):
+        return dict(value)
+    raise TypeError(value)
+
+
+class JsonStore(object):
+    """Data in a json file, optionally with a journal of changes.
+
+    The storage setting is 'json' to rewrite the file for each change or
+    'journal' to append changes to a journal."""
+    def __init__(self, data_file):
+        self.data_file = data_file
+
+    def signature(self):
+        return (file_signature(self.data_file), file_signature(journal.journal_path(self.data_file)))
+
+    def read(self):
+        if os.path.exists(self.data_file):
+            with gc_paused():
+                cached = self.read_cache()
+                if cached is None:
+                    with open(self.data_file) as stream:
+                        cached = json.loads(stream.read())
+                    cached['edges'] = keyed_edges(cached.get('edges', dict()))
+                    self.write_cache(cached)
+            data = GraphData(cached)
+        else:
+            data = GraphData()
+
+        for name, *args in journal.read(self.data_file, data.get('generation')):
+            OPERATIONS[name](data, *args)
+        add_index_loaders(self, data)
+        return data
+
+    def save(self, data):
+        "Save changes. Returns True if the data was moved to another type of store"
+        if data.changes == []:
+            return False
+
+        new_store = store_for_settings(self.data_file, data['settings'])
+        if not isinstance(new_store, JsonStore):
+            new_store.write(data)
+            return True
+
+        if self.uses_journal(data) and data.changes is not None and data.get('generation'):
+            size = journal.append(self.data_file, data['generation'], data.changes)
+            if size > int(data['settings'].get('journal-compact-size') or JOURNAL_COMPACT_SIZE):
+                start_compaction(self.data_file)
+        else:
+            self.write(data)
+
+        data.changes = []
+        return False
+
+    def write(self, data):
+        "Write all the data"
+        if self.uses_journal(data):
+            data['generation'] = journal.new_generation()
+        else:
+            data.pop('generation', None)
+
+        output = json.dumps(json_data(data), default=to_json)
+        with replace_file(self.data_file) as path:
+            with open(path, 'w') as stream:
+                stream.write(output)
+        journal.remove(self.data_file)
+        self.write_cache(data)
+
+    # The cache is a binary copy of the json file which is faster to load:
+    #   a header line describing the json file followed by the data in marshal format.
+    #   It is ignored if the json file does not match the header.
+
+    def cache_path(self):
+        return self.data_file + '.cache'
+
+    def cache_header(self):
+        stat = os.stat(self.data_file)
+        return json.dumps(dict(
+            version=CACHE_VERSION, python=list(sys.version_info[:2]), marshal=marshal.version,
+            inode=stat.st_ino, size=stat.st_size, mtime=stat.st_mtime_ns)).encode('utf8') + b'\n'
+
+    def read_cache(self):
+        "The data in the cache, or None if the cache is missing or out of date"
+        try:
+            stream = open(self.cache_path(), 'rb')
+        except FileNotFoundError:
+            return None
+
+        with stream:
+            header = self.cache_header()
+            if stream.readline() != header:
+                LOGGER.debug('Cache for %r is out of date', self.data_file)
+                return None
+
+            with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view, view[len(header):] as payload:
+                    return marshal.loads(payload)
+
+    def write_cache(self, data):
+        "Write a cache of data, which is the same as the data in the json file"
+        edges = data['edges']
+        node_info = data['node_info']
+        cached = dict(data)
+        # Each name is then written and read once
+        cached['nodes'] = [sys.intern(node) for node in data['nodes']]
+        cached['edges'] = {
+            sys.intern(source): dict.fromkeys((sys.intern(label), sys.intern(target)) for label, target in edges[source])
+            for source in edges}
+        cached['node_info'] = {sys.intern(node): node_info[node] for node in node_info}
+
+        try:
+            with replace_file(self.cache_path()) as path:
+                with open(path, 'wb') as stream:
+                    stream.write(self.cache_header())
+                    stream.write(marshal.dumps(cached))
+        except OSError:
+            LOGGER.debug('Could not write cache for %r', self.data_file, exc_info=True)
+
+    @staticmethod
+    def uses_journal(data):
+        return data['settings'].get('storage') == 'journal'
+
+def start_compaction(data_file):
+    "Fold the journal into the snapshot in a background process"
+    import subprocess
+    LOGGER.debug('Compacting %r', data_file)
+    subprocess.Popen(
+        [sys.executable, '-m', 'clidigraph', '--no-server',
+         '--config-dir', os.path.dirname(data_file), '--graph', os.path.basename(data_file),
+         'compact'],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE nodes (name TEXT PRIMARY KEY);
+CREATE TABLE edges (position INTEGER PRIMARY KEY, source TEXT NOT NULL, label TEXT NOT NULL, target TEXT NOT NULL);
+CREATE UNIQUE INDEX edges_source ON edges (source, label, target);
+CREATE INDEX edges_target ON edges (target);
+CREATE TABLE node_tags (position INTEGER PRIMARY KEY, node TEXT NOT NULL, tag TEXT NOT NULL);
+CREATE INDEX node_tags_node ON node_tags (node, tag);
+CREATE INDEX node_tags_tag ON node_tags (tag);
+CREATE TABLE node_info (node TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (node, key));
+CREATE TABLE tags (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+def migrate_schema(db):
+    "Remove repeated edges from databases written before edges were unique, and make them unique"
+    sql, = db.execute("SELECT sql FROM sqlite_master WHERE name = 'edges_source'").fetchone()
+    if 'UNIQUE' in sql:
+        return
+    LOGGER.debug('Removing repeated edges')
+    db.execute(
+        'DELETE FROM edges WHERE position NOT IN '
+        '(SELECT min(position) FROM edges GROUP BY source, label, target)')
+    db.execute('DROP INDEX edges_source')
+    db.execute('CREATE UNIQUE INDEX edges_source ON edges (source, label, target)')
+
+class SqliteStore(object):
+    """Data in an sqlite database. Rows are read as they are needed, so
+    commands about a few nodes only read those nodes."""
+    def __init__(self, data_file):
+        self.data_file = data_file
+
+    def signature(self):
+        return file_signature(self.data_file)
+
+    def read(self):
+        import sqlite3
+        data = SqliteGraphData(sqlite3.connect(self.data_file))
+        add_index_loaders(self, data)
+        return data
+
+    def save(self, data):
+        "Save changes. Returns True if the data was moved to another type of store"
+        if data.changes == []:
+            return False
+
+        new_store = store_for_settings(self.data_file, data['settings'])
+        if not isinstance(new_store, SqliteStore) or data.changes is None:
+            new_store.write(data)
+            return True
+
+        with data.connection:
+            migrate_schema(data.connection)
+            for name, *args in data.changes:
+                SQL_OPERATIONS[name](data.connection, *args)
+        data['nodes'].mark_saved()
+        data.changes = []
+        return False
+
+    def write(self, data):
+        "Write all the data to a new database"
+        import sqlite3
+        with replace_file(self.data_file) as path:
+            connection = sqlite3.connect(path)
+            try:
+                with connection:
+                    connection.executescript(SQLITE_SCHEMA)
+                    connection.executemany('INSERT INTO nodes (name) VALUES (?)', ((n,) for n in data['nodes']))
+                    connection.executemany(
+                        'INSERT INTO edges (source, label, target) VALUES (?, ?, ?)',
+                        ((source, label, target)
+                         for source, edges in data['edges'].items()
+                         for label, target in edges))
+                    connection.executemany(
+                        'INSERT INTO node_tags (node, tag) VALUES (?, ?)',
+                        ((node, tag)
+                         for node, info in data['node_info'].items()
+                         for tag in info.get('tags', list())))
+                    connection.executemany(
+                        'INSERT INTO node_info (node, key, value) VALUES (?, ?, ?)',
+                        ((node, key, json.dumps(value))
+                         for node, info in data['node_info'].items()
+                         for key, value in info.items() if key != 'tags'))
+                    connection.executemany(
+                        'INSERT INTO tags (name, value) VALUES (?, ?)',
+                        ((k, json.dumps(v)) for k, v in data['tags'].items()))
+                    connection.executemany(
+                        'INSERT INTO settings (key, value) VALUES (?, ?)',
+                        ((k, json.dumps(v)) for k, v in data['settings'].items()))
+            finally:
+                connection.close()
+        journal.remove(self.data_file)
+
+
+# Saved indexes are a header line describing the store followed by
+#   the arguments to create the index in marshal format.
+#   They are ignored if the store does not match the header.
+
+def index_path(data_file, name):
+    return '{}.{}'.format(data_file, name)
+
+def index_header(store):
+    return json.dumps(dict(
+        version=INDEX_VERSION, python=list(sys.version_info[:2]), marshal=marshal.version,
+        signature=store.signature())).encode('utf8') + b'\n'
+
+def add_index_loaders(store, data):
+    "Read saved indexes for data when they are first needed"
+    for name, index_class in SAVED_INDEXES.items():
+        data.loaders[name] = functools.partial(read_index, store, name, index_class)
+
+def read_index(store, name, index_class):
+    "A saved index, or None if it is missing or out of date"
+    try:
+        stream = open(index_path(store.data_file, name), 'rb')
+    except FileNotFoundError:
+        return None
+
+    with stream:
+        if stream.readline() != index_header(store):
+            LOGGER.debug('Saved %s index for %r is out of date', name, store.data_file)
+            return None
+        return index_class(*marshal.load(stream))
+
+def save_indexes(store, data):
+    "Save the indexes that a command built for later commands"
+    header = None
+    for name in SAVED_INDEXES:
+        if name not in data.indexes:
+            continue
+
+        path = index_path(store.data_file, name)
+        header = header or index_header(store)
+        try:
+            with open(path, 'rb') as stream:
+                if stream.readline() == header:
+                    continue
+        except FileNotFoundError:
+            pass
+
+        try:
+            with replace_file(path) as temp_path:
+                with open(temp_path, 'wb') as stream:
+                    stream.write(header)
+                    marshal.dump(data.indexes[name].to_tuple(), stream)
+        except OSError:
+            LOGGER.debug('Could not save %s index for %r', name, store.data_file, exc_info=True)
+
+
+class SqliteGraphData(GraphData):
+    "Graph data read from a database as it is used"
+    def __init__(self, connection):
+        self.connection = connection
+        GraphData.__init__(
+            self,
+            nodes=LazyNodes(connection),
+            edges=LazyMapping(self._read_edges, self._read_all_edges),
+            node_info=LazyMapping(self._read_node_info, self._read_all_node_info),
+            tags={k: json.loads(v) for k, v in connection.execute('SELECT name, value FROM tags')},
+            settings={k: json.loads(v) for k, v in connection.execute('SELECT key, value FROM settings')})
+        self.indexes['predecessors'] = LazyMapping(self._read_predecessors, self._read_all_predecessors)
+        self.indexes['names'] = LazyNameIndex(self['nodes'])
+        self.indexes['tagged'] = TagIndex(
+            LazyMapping(self._read_tagged, self._read_all_tagged),
+            LazyMapping(self._read_valued, self._read_all_valued))
+
+    def _read_edges(self, source):
+        rows = self.connection.execute(
+            'SELECT label, target FROM edges WHERE source = ? ORDER BY position', (source,))
+        return dict.fromkeys(rows) or None
+
+    def _read_all_edges(self):
+        result = collections.OrderedDict()
+        for source, label, target in self.connection.execute(
+                'SELECT source, label, target FROM edges ORDER BY position'):
+            result.setdefault(source, dict())[(label, target)] = None
+        return result.items()
+
+    def _read_predecessors(self, target):
+        rows = self.connection.execute(
+            'SELECT label, source FROM edges WHERE target = ? ORDER BY position', (target,))
+        return dict.fromkeys(rows) or None
+
+    def _read_all_predecessors(self):
+        result = dict()
+        for source, label, target in self.connection.execute(
+                'SELECT source, label, target FROM edges ORDER BY position'):
+            result.setdefault(target, dict())[(label, source)] = None
+        return result.items()
+
+    def _read_tagged(self, tag):
+        rows = self.connection.execute('SELECT node FROM node_tags WHERE tag = ?', (tag,))
+        return set(node for node, in rows) or None
+
+    def _read_all_tagged(self):
+        result = dict()
+        for node, tag in self.connection.execute('SELECT node, tag FROM node_tags'):
+            result.setdefault(tag, set()).add(node)
+        return result.items()
+
+    def _read_valued(self, value):
+        rows = self.connection.execute(
+            "SELECT node FROM node_info WHERE key = 'tag' AND value = ?", (json.dumps(value),))
+        return set(node for node, in rows) or None
+
+    def _read_all_valued(self):
+        result = dict()
+        for node, value in self.connection.execute("SELECT node, value FROM node_info WHERE key = 'tag'"):
+            value = json.loads(value)
+            if isinstance(value, str):
+                result.setdefault(value, set()).add(node)
+        return result.items()
+
+    def _read_node_info(self, node):
+        info = {
+            key: json.loads(value)
+            for key, value in self.connection.execute(
+                'SELECT key, value FROM node_info WHERE node = ?', (node,))}
+        tags = [tag for tag, in self.connection.execute(
+            'SELECT tag FROM node_tags WHERE node = ? ORDER BY position', (node,))]
+        if tags:
+            info['tags'] = tags
+        return info or None
+
+    def _read_all_node_info(self):
+        result = dict()
+        for node, key, value in self.connection.execute('SELECT node, key, value FROM node_info'):
+            result.setdefault(node, dict())[key] = json.loads(value)
+        for node, tag in self.connection.execute('SELECT node, tag FROM node_tags ORDER BY position'):
+            result.setdefault(node, dict()).setdefault('tags', list()).append(tag)
+        return result.items()
+
+
+class LazyMapping(collections.abc.MutableMapping):
+    "A mapping read a key at a time. Changes are kept in memory"
+    def __init__(self, read_key, read_all):
+        self._read_key = read_key
+        self._read_all = read_all
+        self._cache = dict()
+        self._missing = set()
+        self._complete = False
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            if self._complete or key in self._missing:
+                raise KeyError(key)
+            value = self._read_key(key)
+            if value is None:
+                self._missing.add(key)
+                raise KeyError(key)
+            self._cache[key] = value
+        return self._cache[key]
+
+    def __setitem__(self, key, value):
+        self._cache[key] = value
+        self._missing.discard(key)
+
+    def __delitem__(self, key):
+        self.__getitem__(key)
+        del self._cache[key]
+        self._missing.add(key)
+
+    def __iter__(self):
+        self._read_everything()
+        return iter(self._cache)
+
+    def __len__(self):
+        self._read_everything()
+        return len(self._cache)
+
+    def _read_everything(self):
+        if not self._complete:
+            for key, value in self._read_all():
+                if key not in self._cache and key not in self._missing:
+                    self._cache[key] = value
+            self._complete = True
+
+
+class LazyNodes(object):
+    "The list of nodes read from a database as it is needed. Changes are kept in memory"
+    def __init__(self, connection):
+        self._connection = connection
+        self._names = None
+        # name -> whether it is a node
+        self._present = dict()
+        # Changes made before all names were read
+        self._changes = []
+
+    def __contains__(self, name):
+        if name not in self._present:
+            if self._names is not None:
+                return False
+            self._present[name] = bool(list(self._connection.execute(
+                'SELECT 1 FROM nodes WHERE name = ?', (name,))))
+        return self._present[name]
+
+    def append(self, name):
+        self._present[name] = True
+        if self._names is None:
+            self._changes.append((True, name))
+        else:
+            self._names.append(name)
+
+    def remove(self, name):
+        if name not in self:
+            raise ValueError(name)
+        self._present[name] = False
+        if self._names is None:
+            self._changes.append((False, name))
+        else:
+            self._names.remove(name)
+
+    def mark_saved(self):
+        "Changes have been written to the database"
+        self._changes = []
+
+    def __iter__(self):
+        return iter(list(self._read_everything()))
+
+    def __len__(self):
+        return len(self._read_everything())
+
+    def _read_everything(self):
+        if self._names is None:
+            self._names = [name for name, in self._connection.execute('SELECT name FROM nodes ORDER BY rowid')]
+            for added, name in self._changes:
+                if added:
+                    self._names.append(name)
+                else:
+                    self._names.remove(name)
+            self._changes = []
+            self._present = dict.fromkeys(self._names, True)
+        return self._names
+
+
+class LazyNameIndex(graphs.NameIndex):
+    "Names of nodes read from a database. Names are looked up one at a time until they are searched"
+    def __init__(self, nodes):
+        # Operations change nodes before they change this index
+        self.names = nodes
+        self.trigrams = None
+        self.searches = 0
+
+    def add(self, name):
+        self.add_trigrams(name)
+
+    def remove(self, name):
+        self.remove_trigrams(name)
+
+
+SQL_OPERATIONS = dict()
+
+def sql_operation(func):
+    "Decorator for the sql that saves an operation"
+    SQL_OPERATIONS[func.__name__[len('sql_'):]] = func
+    return func
+
+@sql_operation
+def sql_add_node(db, name):
+    db.execute('INSERT INTO nodes (name) VALUES (?)', (name,))
+
+@sql_operation
+def sql_remove_node(db, name):
+    db.execute('DELETE FROM nodes WHERE name = ?', (name,))
+    db.execute('DELETE FROM edges WHERE source = ? OR target = ?', (name, name))
+    db.execute('DELETE FROM node_info WHERE node = ?', (name,))
+    db.execute('DELETE FROM node_tags WHERE node = ?', (name,))
+
+@sql_operation
+def sql_rename_node(db, old, new):
+    db.execute('UPDATE nodes SET name = ? WHERE name = ?', (new, old))
+    db.execute('UPDATE OR REPLACE edges SET source = ? WHERE source = ?', (new, old))
+    db.execute('UPDATE OR REPLACE edges SET target = ? WHERE target = ?', (new, old))
+    db.execute('DELETE FROM node_info WHERE node = ?', (new,))
+    db.execute('UPDATE node_info SET node = ? WHERE node = ?', (new, old))
+    db.execute('DELETE FROM node_tags WHERE node = ?', (new,))
+    db.execute('UPDATE node_tags SET node = ? WHERE node = ?', (new, old))
+
+@sql_operation
+def sql_add_edge(db, source, label, target):
+    db.execute('INSERT OR IGNORE INTO edges (source, label, target) VALUES (?, ?, ?)', (source, label, target))
+
+@sql_operation
+def sql_remove_edge(db, source, label, target):
+    db.execute('DELETE FROM edges WHERE source = ? AND label = ? AND target = ?', (source, label, target))
+
+@sql_operation
+def sql_set_node_info(db, node, key, value):
+    db.execute('INSERT OR REPLACE INTO node_info (node, key, value) VALUES (?, ?, ?)', (node, key, json.dumps(value)))
+
+@sql_operation
+def sql_add_node_tag(db, node, tag):
+    db.execute(
+        'INSERT INTO node_tags (node, tag) SELECT ?, ? '
+        'WHERE NOT EXISTS (SELECT 1 FROM node_tags WHERE node = ? AND tag = ?)',
+        (node, tag, node, tag))
+
+@sql_operation
+def sql_remove_node_tag(db, node, tag):
+    db.execute('DELETE FROM node_tags WHERE node = ? AND tag = ?', (node, tag))
+
+@sql_operation
+def sql_create_tag(db, tag):
+    db.execute('INSERT OR REPLACE INTO tags (name, value) VALUES (?, ?)', (tag, json.dumps([])))
+
+@sql_operation
+def sql_rename_tag(db, old, new):
+    db.execute('DELETE FROM tags WHERE name = ?', (new,))
+    db.execute('UPDATE tags SET name = ? WHERE name = ?', (new, old))
+    db.execute(
+        'DELETE FROM node_tags WHERE tag = ? AND node IN (SELECT node FROM node_tags WHERE tag = ?)',
+        (old, new))
+    db.execute('UPDATE node_tags SET tag = ? WHERE tag = ?', (new, old))
+
+@sql_operation
+def sql_delete_tag(db, tag):
+    db.execute('DELETE FROM tags WHERE name = ?', (tag,))
+    db.execute('DELETE FROM node_tags WHERE tag = ?', (tag,))
+
+@sql_operation
+def sql_set_setting(db, key, value):
+    db.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+
+@contextlib.contextmanager
+def gc_paused():
+    "Loading data creates many objects but no cycles. Garbage collection only slows it down"
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+@contextlib.contextmanager
+def replace_file(filename):
+    """Yield the path of a temporary file to write to. It is renamed to filename at
+    the end so that readers never see partial data"""
+    import tempfile
+    directory, basename = os.path.split(filename)
+    handle, path = tempfile.mkstemp(dir=directory, prefix=basename + '.', suffix='.tmp')
+    os.close(handle)
+    try:
+        yield path
+        with open(path, 'rb') as stream:
+            os.fsync(stream.fileno())
+        os.chmod(path, file_mode(filename))
+    except:
+        os.unlink(path)
+        raise
+    os.replace(path, filename)
+
+def file_mode(filename):
+    "The mode of a file, or the default mode for new files"
+    if os.path.exists(filename):
+        return os.stat(filename).st_mode
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+def file_signature(filename):
+    "Something that changes when the file is changed"
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
 
 def get_tag(data, tag):
     possible = [t for t in data['tags'] if re.search(tag, t)]
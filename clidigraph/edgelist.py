@@ -0,0 +1,169 @@
+"""Reading and writing graphs as lists of nodes and edges.
+
+Formats are
+  tsv, csv: a row for each node (one column) then each edge (source, target, label).
+      Rows with two columns are edges with the default label
+  jsonl: {"node": name} for each node then {"source": ..., "target": ..., "label": ...} for each edge
+  dot: a digraph with a statement for each node and edge. Only simple statements
+      of one node or one edge per line are read"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import csv
+import json
+import os
+import re
+
+from . import graphs
+
+FORMATS = ('tsv', 'csv', 'jsonl', 'dot')
+
+EXTENSIONS = {'.tsv': 'tsv', '.txt': 'tsv', '.csv': 'csv', '.jsonl': 'jsonl', '.dot': 'dot', '.gv': 'dot'}
+
+
+def guess_format(filename):
+    "The format for a file name, tsv if it cannot be told"
+    return EXTENSIONS.get(os.path.splitext(filename)[1].lower(), 'tsv')
+
+def read_items(stream, file_format):
+    "Yield ('node', name) and ('edge', source, label, target) for what is in stream"
+    return READERS[file_format](stream)
+
+def write_graph(data, stream, file_format):
+    "Write every node and edge of data. Output is sorted so that exports can be compared"
+    nodes = sorted(set(data['nodes']))
+    edges = sorted(
+        (source, target, label)
+        for source, source_edges in data['edges'].items()
+        for label, target in source_edges)
+    WRITERS[file_format](stream, nodes, edges)
+
+def import_items(data, items):
+    """Add the nodes and edges in items to data that it does not already have.
+    Changes are not recorded so the store rewrites all the data. Returns the numbers added"""
+    nodes = set(data['nodes'])
+    edges = data['edges']
+    added_nodes = added_edges = 0
+
+    def add_node(name):
+        nonlocal added_nodes
+        if name not in nodes:
+            nodes.add(name)
+            data['nodes'].append(name)
+            added_nodes += 1
+
+    for item in items:
+        if item[0] == 'node':
+            add_node(item[1])
+        else:
+            _, source, label, target = item
+            add_node(source)
+            add_node(target)
+            source_edges = edges.setdefault(source, dict())
+            if (label, target) not in source_edges:
+                source_edges[(label, target)] = None
+                added_edges += 1
+
+    data.rewrite()
+    return added_nodes, added_edges
+
+
+def read_rows(rows, format_name):
+    for number, row in enumerate(rows, 1):
+        if len(row) == 1:
+            yield ('node', row[0])
+        elif len(row) == 2:
+            yield ('edge', row[0], graphs.DEFAULT, row[1])
+        elif len(row) == 3:
+            yield ('edge', row[0], row[2], row[1])
+        elif row:
+            raise ValueError('Line {}: expected 1 to 3 {} columns not {}'.format(number, format_name, len(row)))
+
+# Tabs, newlines, carriage returns and backslashes in names are escaped with a backslash.
+#   Quotes are not used: the quote character is one that the writer must escape
+TSV_OPTIONS = dict(delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='\\', quotechar='\r')
+
+def read_tsv(stream):
+    return read_rows(csv.reader(stream, **TSV_OPTIONS), 'tsv')
+
+def read_csv(stream):
+    return read_rows(csv.reader(stream), 'csv')
+
+def write_rows(writer, nodes, edges):
+    writer.writerows([node] for node in nodes)
+    writer.writerows(edges)
+
+def write_tsv(stream, nodes, edges):
+    if '' in nodes:
+        # It would be an empty line
+        raise ValueError('A node with an empty name cannot be written as tsv. Use csv or jsonl')
+    write_rows(csv.writer(stream, lineterminator='\n', **TSV_OPTIONS), nodes, edges)
+
+def write_csv(stream, nodes, edges):
+    # Fields with either line ending character are quoted
+    write_rows(csv.writer(stream, lineterminator='\r\n'), nodes, edges)
+
+def read_jsonl(stream):
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if 'node' in item:
+            yield ('node', item['node'])
+        elif 'source' in item and 'target' in item:
+            yield ('edge', item['source'], item.get('label', graphs.DEFAULT), item['target'])
+        else:
+            raise ValueError('Line {}: expected a node or an edge'.format(number))
+
+def write_jsonl(stream, nodes, edges):
+    for node in nodes:
+        stream.write(json.dumps(dict(node=node)) + '\n')
+    for source, target, label in edges:
+        stream.write(json.dumps(dict(source=source, target=target, label=label)) + '\n')
+
+
+DOT_ID = r'"(?:[^"\\]|\\.)*"|[\w.]+'
+DOT_EDGE = re.compile(r'({id})\s*->\s*({id})\s*(?:\[(.*)\])?\s*;?$'.format(id=DOT_ID))
+DOT_NODE = re.compile(r'({id})\s*(?:\[(.*)\])?\s*;?$'.format(id=DOT_ID))
+DOT_LABEL = re.compile(r'\blabel\s*=\s*({id})'.format(id=DOT_ID))
+# Statements that do not describe nodes or edges
+DOT_IGNORED = re.compile(r'^(?:(?:strict\s+)?(?:di)?graph\b.*\{|\}|(?:graph|node|edge)\s*\[.*|[\w.]+\s*=.*|//.*|#.*)$')
+
+def dot_unquote(identifier):
+    if identifier.startswith('"'):
+        return re.sub(r'\\(.)', lambda match: DOT_ESCAPES.get(match.group(1), match.group(1)), identifier[1:-1])
+    return identifier
+
+def dot_quote(name):
+    return '"' + name.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r') + '"'
+
+DOT_ESCAPES = dict(n='\n', r='\r')
+
+def read_dot(stream):
+    for number, line in enumerate(stream, 1):
+        statement = line.strip()
+        if not statement or DOT_IGNORED.match(statement):
+            continue
+
+        edge = DOT_EDGE.match(statement)
+        node = DOT_NODE.match(statement)
+        if edge:
+            source, target, attributes = edge.groups()
+            label = DOT_LABEL.search(attributes or '')
+            yield ('edge', dot_unquote(source), dot_unquote(label.group(1)) if label else graphs.DEFAULT, dot_unquote(target))
+        elif node:
+            yield ('node', dot_unquote(node.group(1)))
+        else:
+            raise ValueError('Line {}: cannot read {!r}'.format(number, statement))
+
+def write_dot(stream, nodes, edges):
+    stream.write('digraph {\n')
+    for node in nodes:
+        stream.write('    {};\n'.format(dot_quote(node)))
+    for source, target, label in edges:
+        stream.write('    {} -> {} [label={}];\n'.format(dot_quote(source), dot_quote(target), dot_quote(label)))
+    stream.write('}\n')
+
+
+READERS = dict(tsv=read_tsv, csv=read_csv, jsonl=read_jsonl, dot=read_dot)
+WRITERS = dict(tsv=write_tsv, csv=write_csv, jsonl=write_jsonl, dot=write_dot)
@@ -1,31 +1,633 @@
 "Utilities to operate on graphs"
 
+import array
+import bisect
+import collections
 import functools
 import itertools
+import re
+
+from . import timings
 
 DEFAULT = 'default'
 IMPLICIT = 'implicit'
 
-def merge_graphs(*graphs):
-    return functools.reduce(merge_graph_pair, graphs)
 
-def merge_graph_pair(a, b):
-    result = dict(nodes=[], edges=dict())
-    result['nodes'] = list(sorted(set(itertools.chain(a['nodes'], b['nodes']))))
+class Graph(dict):
+    """A graph: a dictionary of nodes and edges.
+
+    Indexes built from the graph are kept with it until it is changed.
+    Saved indexes can be read by loaders instead of being built."""
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.indexes = dict()
+        # name -> function returning the index or None
+        self.loaders = dict()
+
+    def changed(self, keep=()):
+        "Drop indexes except those in keep"
+        for indexes in (self.indexes, self.loaders):
+            for name in list(indexes):
+                if name not in keep:
+                    del indexes[name]
+
+def get_index(graph, name, build):
+    "An index for a graph. Built once for each Graph, every time for other dictionaries"
+    if not isinstance(graph, Graph):
+        return build(graph)
+    if name not in graph.indexes:
+        with timings.phase('index ' + name):
+            loader = graph.loaders.pop(name, None)
+            index = loader and loader()
+            graph.indexes[name] = build(graph) if index is None else index
+    return graph.indexes[name]
+
+def indexed(graph):
+    return get_index(graph, 'indexed', IndexedGraph)
+
+def predecessors(graph):
+    "target -> {(label, source): None, ...} for the edges into each node"
+    return get_index(graph, 'predecessors', predecessor_index)
+
+def predecessor_index(graph):
+    result = dict()
+    for source in graph['edges']:
+        for label, target in graph['edges'][source]:
+            result.setdefault(target, dict())[(label, source)] = None
+    return result
+
+def names(graph):
+    "The node names of a graph, for finding nodes by name or pattern"
+    return get_index(graph, 'names', NameIndex)
+
+
+class NameIndex(object):
+    """The node names of a graph in a set.
+
+    Names are also indexed by their trigrams so that a regular expression
+    is only matched against the names that contain the text it requires"""
+    # Building trigrams costs more than one search of every name
+    TRIGRAM_SEARCHES = 2
+
+    def __init__(self, graph):
+        self.names = set(graph['nodes'])
+        self.trigrams = None
+        self.searches = 0
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def add(self, name):
+        self.names.add(name)
+        self.add_trigrams(name)
+
+    def remove(self, name):
+        self.names.discard(name)
+        self.remove_trigrams(name)
+
+    def add_trigrams(self, name):
+        if self.trigrams is not None:
+            for trigram in trigrams(name):
+                self.trigrams.setdefault(trigram, set()).add(name)
+
+    def remove_trigrams(self, name):
+        if self.trigrams is not None:
+            for trigram in trigrams(name):
+                self.trigrams[trigram].discard(name)
+
+    def search(self, pattern):
+        "The names that a regular expression matches"
+        regex = compile_pattern(pattern)
+        return [name for name in self.candidates(pattern) if regex.search(name)]
+
+    def candidates(self, pattern):
+        "Names that might match a regular expression"
+        required = set(itertools.chain.from_iterable(map(trigrams, required_literals(pattern))))
+        self.searches += 1
+        if not required or (self.trigrams is None and self.searches < self.TRIGRAM_SEARCHES):
+            return self.names
+
+        if self.trigrams is None:
+            self.trigrams = dict()
+            for name in self.names:
+                self.add_trigrams(name)
+
+        sets = sorted((self.trigrams.get(trigram, set()) for trigram in required), key=len)
+        return set.intersection(*sets)
+
+compile_pattern = functools.lru_cache(maxsize=None)(re.compile)
+
+def trigrams(name):
+    return set(name[i:i + 3] for i in range(len(name) - 2))
+
+def required_literals(pattern):
+    """Strings that every match of a regular expression contains.
+
+    Only simple patterns are understood. Others may give fewer strings"""
+    if '|' in pattern or '(?' in pattern:
+        return []
+
+    literals = ['']
+    # Characters in groups are ignored
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        i += 1
+        literal = None
+        if char == '\\':
+            escaped = pattern[i:i + 1]
+            i += 1
+            if escaped and not escaped.isalnum():
+                literal = escaped
+            else:
+                i = escape_end(pattern, escaped, i)
+        elif char == '[':
+            i = character_set_end(pattern, i)
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char in '*?{':
+            # The character before is optional
+            literals[-1] = literals[-1][:-1]
+            if char == '{':
+                i = pattern.find('}', i) + 1 or len(pattern)
+        elif char not in '.^$+':
+            literal = char
+
+        if literal is not None and depth == 0:
+            literals[-1] += literal
+        elif literals[-1]:
+            literals.append('')
+    return [literal for literal in literals if literal]
+
+def escape_end(pattern, escaped, start):
+    """The index after the operand of an escape like \\x41 or \\N{name},
+    which starts at start. Digits after the escape are never literals"""
+    if escaped in ESCAPE_OPERAND_LENGTHS:
+        return start + ESCAPE_OPERAND_LENGTHS[escaped]
+    elif escaped == 'N' and pattern[start:start + 1] == '{':
+        return pattern.find('}', start) + 1 or len(pattern)
+    elif escaped.isdigit():
+        # Octal escapes and backreferences
+        while start < len(pattern) and pattern[start].isdigit():
+            start += 1
+    return start
+
+ESCAPE_OPERAND_LENGTHS = dict(x=2, u=4, U=8)
+
+def character_set_end(pattern, start):
+    "The index after the ] closing a character set that starts at start"
+    i = start
+    if pattern[i:i + 1] == '^':
+        i += 1
+    if pattern[i:i + 1] == ']':
+        i += 1
+    while i < len(pattern):
+        if pattern[i] == '\\':
+            i += 2
+        elif pattern[i] == ']':
+            return i + 1
+        else:
+            i += 1
+    return len(pattern)
+
+
+class IndexedGraph(object):
+    """A graph with nodes and labels numbered and edges stored in arrays.
+
+    Nodes include every source and target of an edge even if
+    they are not in graph["nodes"]"""
+    def __init__(self, graph):
+        self.names = []
+        self.ids = dict()
+        self.label_names = []
+        self.label_ids = dict()
+
+        for name in graph['nodes']:
+            self.node_id(name)
+
+        sources = array.array('i')
+        labels = array.array('i')
+        targets = array.array('i')
+        edges = graph['edges']
+        ids = self.ids
+        label_ids = self.label_ids
+        # Edges are grouped by source: (source, start, end)
+        ranges = []
+        for source in edges:
+            pairs = edges[source]
+            source_id = self.node_id(source)
+            ranges.append((source_id, len(sources), len(sources) + len(pairs)))
+            sources.extend(array.array('i', [source_id]) * len(pairs))
+            try:
+                # Fast path: targets are normally nodes
+                targets.extend([ids[target] for _, target in pairs])
+            except KeyError:
+                targets.extend([self.node_id(target) for _, target in pairs])
+            try:
+                labels.extend([label_ids[label] for label, _ in pairs])
+            except KeyError:
+                labels.extend([self.label_id(label) for label, _ in pairs])
+
+        starts = array.array('i', [0]) * len(self.names)
+        ends = array.array('i', [0]) * len(self.names)
+        for source_id, start, end in ranges:
+            starts[source_id] = start
+            ends[source_id] = end
+        self.forward = Adjacency(starts, ends, labels, targets)
+        self.reverse = Adjacency.from_edges(len(self.names), targets, labels, sources)
+
+    def node_id(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def label_id(self, label):
+        if label not in self.label_ids:
+            self.label_ids[label] = len(self.label_names)
+            self.label_names.append(label)
+        return self.label_ids[label]
+
+    def bitmap(self, names):
+        "A bytearray with 1 for each of the named nodes"
+        result = bytearray(len(self.names))
+        for name in names:
+            if name in self.ids:
+                result[self.ids[name]] = 1
+        return result
+
+    def root_ids(self, roots):
+        "The ids of the distinct roots that are nodes"
+        return [self.ids[root] for root in set(roots) if root in self.ids]
+
+    def strict_search(self, adjacency, roots):
+        """Node ids reachable in adjacency from a root other than themselves.
+
+        Each node is labelled with up to two of the roots reaching it,
+        so nodes and edges are visited at most twice"""
+        starts = adjacency.starts
+        ends = adjacency.ends
+        targets = adjacency.targets
+        origins = dict((root, [root]) for root in roots)
+        border = [(root, root) for root in roots]
+        while border:
+            new_border = []
+            for node, origin in border:
+                for target in targets[starts[node]:ends[node]]:
+                    target_origins = origins.setdefault(target, [])
+                    if len(target_origins) < 2 and origin not in target_origins:
+                        target_origins.append(origin)
+                        new_border.append((target, origin))
+            border = new_border
+        return [node for node, node_origins in origins.items() if node_origins != [node]]
+
+    def search(self, adjacency, roots, depth=None):
+        """Breadth first search of adjacency from the node ids in roots.
 
-    for source in set.union(set(a['edges']), set(b['edges'])):
-        result['edges'][source] = list(set.union(
-            set(map(tuple, a['edges'].get(source, list()))),
-            set(map(tuple, b['edges'].get(source, list())))))
+        Returns the nodes found within depth steps and the nodes found in
+        fewer steps, whose edges were followed"""
+        starts = adjacency.starts
+        ends = adjacency.ends
+        targets = adjacency.targets
+        seen = bytearray(len(self.names))
+        for root in roots:
+            seen[root] = 1
 
+        found = list(roots)
+        expanded = []
+        border = found
+        steps = 0
+        while border and (depth is None or steps < depth):
+            expanded.extend(border)
+            new_border = []
+            for node in border:
+                for target in targets[starts[node]:ends[node]]:
+                    if not seen[target]:
+                        seen[target] = 1
+                        new_border.append(target)
+            found.extend(new_border)
+            border = new_border
+            steps += 1
+        return found, expanded
+
+
+class Adjacency(object):
+    """Edges stored in arrays. The edges of node i have targets
+    targets[starts[i]:ends[i]] and the corresponding labels"""
+    def __init__(self, starts, ends, labels, targets):
+        self.starts = starts
+        self.ends = ends
+        self.labels = labels
+        self.targets = targets
+
+    @classmethod
+    def from_edges(cls, size, sources, labels, targets):
+        "Group edges given as arrays of sources, labels and targets. labels may be None"
+        # A stable sort keeps the order of each node's edges
+        order = sorted(range(len(sources)), key=sources.__getitem__)
+        sorted_sources = array.array('i', map(sources.__getitem__, order))
+        offsets = array.array('i', (bisect.bisect_left(sorted_sources, i) for i in range(size + 1)))
+        return cls(
+            offsets[:-1], offsets[1:],
+            None if labels is None else array.array('i', map(labels.__getitem__, order)),
+            array.array('i', map(targets.__getitem__, order)))
+
+    def edges(self, node):
+        "(label id, target id) pairs for the edges of a node"
+        start, end = self.starts[node], self.ends[node]
+        return zip(self.labels[start:end], self.targets[start:end])
+
+
+def reachability(graph):
+    "The reachability index of a graph, or None if its settings do not ask for one"
+    if graph.get('settings', dict()).get('reachability-index') != 'yes':
+        return None
+    return get_index(graph, 'reachability', Reachability.build)
+
+
+class Reachability(object):
+    """Which nodes each node can reach.
+
+    Nodes are grouped into strongly connected components, numbered so
+    that edges between components go from higher to lower numbers. The
+    index holds the component of each node and the edges between
+    components, so it takes space in proportion to the graph. Queries
+    search the components, skipping those whose number shows that they
+    cannot be on a path.
+
+    Operations that add nodes and edges update the index. Those that
+    might split a component or remove the last edge between two
+    components cannot, and the index is built again when it is next used"""
+    def __init__(self, components, count, sources, targets):
+        # name -> component
+        self.components = components
+        self.count = count
+        sources = array.array('i', sources)
+        targets = array.array('i', targets)
+        self.successors = Adjacency.from_edges(count, sources, None, targets)
+        self.reverse_edges = (targets, sources)
+        self._predecessors = None
+        # Edges added since the index was built: component -> components
+        self.added_successors = dict()
+        self.added_predecessors = dict()
+        self.members = None
+
+    @classmethod
+    def build(cls, graph):
+        index = indexed(graph)
+        component, count = strong_components(index.forward)
+        starts = index.forward.starts
+        ends = index.forward.ends
+        targets = index.forward.targets
+        edges = set()
+        for node, node_component in enumerate(component):
+            for target in targets[starts[node]:ends[node]]:
+                if component[target] != node_component:
+                    edges.add((node_component, component[target]))
+        edges = sorted(edges)
+        return cls(
+            dict(zip(index.names, component)), count,
+            array.array('i', [source for source, _ in edges]), array.array('i', [target for _, target in edges]))
+
+    def to_tuple(self):
+        "Arguments to recreate the index"
+        sources = array.array('i')
+        targets = array.array('i')
+        for source in range(self.count):
+            for target in self.neighbours(self.successors, self.added_successors, source):
+                sources.append(source)
+                targets.append(target)
+        return (self.components, self.count, sources.tobytes(), targets.tobytes())
+
+    @property
+    def predecessors(self):
+        if self._predecessors is None:
+            sources, targets = self.reverse_edges
+            self._predecessors = Adjacency.from_edges(self.count, sources, None, targets)
+        return self._predecessors
+
+    def component_members(self):
+        "The nodes in each component"
+        if self.members is None:
+            self.members = [[] for _ in range(self.count)]
+            for name, component in self.components.items():
+                self.members[component].append(name)
+        return self.members
+
+    # Changes made by operations. These return False if the index cannot be kept
+
+    def add_node(self, name):
+        if name not in self.components:
+            self.components[name] = self.count
+            if self.members is not None:
+                self.members.append([name])
+            self.count += 1
+        return True
+
+    def add_edge(self, source, target):
+        self.add_node(source)
+        self.add_node(target)
+        source, target = self.components[source], self.components[target]
+        if source == target:
+            return True
+        elif source < target:
+            # The numbering would no longer be a topological order
+            return False
+        self.added_successors.setdefault(source, []).append(target)
+        self.added_predecessors.setdefault(target, []).append(source)
+        return True
+
+    def remove_edge(self, source, target):
+        # An edge within a component of one node is a loop
+        return source == target
+
+    def remove_node(self, name, has_edges):
+        if has_edges:
+            return False
+        component = self.components.pop(name, None)
+        if self.members is not None and component is not None:
+            self.members[component].remove(name)
+        return True
+
+    def rename_node(self, old, new):
+        component = self.components.pop(old, None)
+        if component is None:
+            return True
+        self.components[new] = component
+        if self.members is not None:
+            members = self.members[component]
+            members[members.index(old)] = new
+        return True
+
+    # Queries
+
+    def neighbours(self, adjacency, added, component):
+        if component < len(adjacency.starts):
+            yield from adjacency.targets[adjacency.starts[component]:adjacency.ends[component]]
+        yield from added.get(component, ())
+
+    def search(self, adjacency, added, starts, allowed=None):
+        "The components reached from starts, only entering those for which allowed is true"
+        seen = set(starts)
+        stack = list(seen)
+        while stack:
+            for target in self.neighbours(adjacency, added, stack.pop()):
+                if target not in seen and (allowed is None or allowed(target)):
+                    seen.add(target)
+                    stack.append(target)
+        return seen
+
+    def names(self, components):
+        "The nodes in components"
+        members = self.component_members()
+        result = set()
+        for component in components:
+            result.update(members[component])
+        return result
+
+    def component_set(self, names):
+        return set(self.components[name] for name in names if name in self.components)
+
+    def between(self, from_nodes, to_nodes):
+        "Nodes on paths from from_nodes to to_nodes"
+        unknown = set(from_nodes) & set(to_nodes) - self.components.keys()
+        sources = self.component_set(from_nodes)
+        targets = self.component_set(to_nodes)
+        if not sources or not targets:
+            return unknown
+
+        # Components with lower numbers than every target cannot reach one
+        lowest = min(targets)
+        forward = self.search(
+            self.successors, self.added_successors,
+            [source for source in sources if source >= lowest], lambda component: component >= lowest)
+        # Every component on a path is in forward
+        backward = self.search(
+            self.predecessors, self.added_predecessors, targets & forward, forward.__contains__)
+        return unknown | self.names(backward)
+
+    def strictly_after(self, roots):
+        "Nodes reachable from a root other than themselves"
+        return self.strictly(self.successors, self.added_successors, roots)
+
+    def strictly_before(self, roots):
+        "Nodes leading to a root other than themselves"
+        return self.strictly(self.predecessors, self.added_predecessors, roots)
+
+    def strictly(self, adjacency, added, roots):
+        roots = set(roots) & self.components.keys()
+        shared = collections.Counter(self.components[root] for root in roots)
+        # Components reached by at least one edge from a root's component
+        following = set()
+        for component in shared:
+            following.update(self.neighbours(adjacency, added, component))
+        reached = self.search(adjacency, added, following)
+
+        result = self.names(reached | shared.keys()) - roots
+        # Roots sharing a component reach each other
+        for root in roots:
+            component = self.components[root]
+            if shared[component] > 1 or component in reached:
+                result.add(root)
+        return result
+
+def bit_positions(mask):
+    "The positions of the bits set in an integer, highest first"
+    digits = bin(mask)
+    end = len(digits) - 1
+    result = []
+    position = digits.find('1', 2)
+    while position != -1:
+        result.append(end - position)
+        position = digits.find('1', position + 1)
     return result
 
+def strong_components(adjacency, roots=None, included=None):
+    """The strongly connected component of each node and the number of components.
+    Components are numbered as they are completed so edges go to lower numbers.
+
+    If roots is given only nodes reachable from roots have components (others
+    have -1). If included is given only paths through nodes marked in it are followed"""
+    starts = adjacency.starts
+    ends = adjacency.ends
+    targets = adjacency.targets
+    size = len(starts)
+    number = [-1] * size
+    low = [0] * size
+    on_stack = bytearray(size)
+    component = [-1] * size
+    stack = []
+    counter = 0
+    count = 0
+    for root in range(size) if roots is None else roots:
+        if number[root] != -1:
+            continue
+        number[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        # (node, position of the next edge to follow)
+        work = [(root, starts[root])]
+        while work:
+            node, position = work[-1]
+            if position < ends[node]:
+                work[-1] = (node, position + 1)
+                target = targets[position]
+                if included is not None and not included[target]:
+                    continue
+                if number[target] == -1:
+                    number[target] = low[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    on_stack[target] = 1
+                    work.append((target, starts[target]))
+                elif on_stack[target]:
+                    low[node] = min(low[node], number[target])
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == number[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    component[member] = count
+                    if member == node:
+                        break
+                count += 1
+    return component, count
+
+
+def merge_graphs(*graphs):
+    """The union of graphs, with sorted nodes and without repeated edges.
+    A single graph is returned as it is"""
+    if len(graphs) == 1:
+        return graphs[0]
+
+    nodes = set()
+    edges = dict()
+    for graph in graphs:
+        nodes.update(graph['nodes'])
+        for source, pairs in graph['edges'].items():
+            edges.setdefault(source, set()).update(map(tuple, pairs))
+    return Graph(nodes=sorted(nodes), edges={source: list(pairs) for source, pairs in edges.items()})
+
 def between_graph(graph:dict, from_nodes:set, to_nodes:set) -> dict:
-    # This is O(n) but n is small
+    reachable = reachability(graph)
+    if reachable is None:
+        return intersect_graph(before_graphs(graph, to_nodes), after_graphs(graph, from_nodes))
 
-    before_graphs = merge_graphs(*(before_graph(graph, n) for n in to_nodes))
-    after_graphs = merge_graphs(*(after_graph(graph, n) for n in from_nodes))
-    return intersect_graph(before_graphs, after_graphs)
+    nodes = reachable.between(from_nodes, to_nodes)
+    return edge_set_to_graph(nodes, set(
+        (source, label, target)
+        for source in nodes
+        for label, target in graph['edges'].get(source, [])
+        if target in nodes))
 
 def intersect_graph(a, b):
     nodes = set.intersection(set(a['nodes']), set(b['nodes']))
@@ -42,14 +644,27 @@ def edge_set_to_graph(nodes, sett):
     for a, b, c in sett:
         edge_dict.setdefault(a, list())
         edge_dict[a].append((b, c))
-    return dict(edges=edge_dict, nodes=all_nodes)
+    return Graph(edges=edge_dict, nodes=all_nodes)
 
 def before_graph(graph, x, depth=None):
     "Return the subgraph of things leading to x."
-    return reverse_graph(after_graph(reverse_graph(graph), x, depth))
+    return before_graphs(graph, [x], depth)
+
+def before_graphs(graph, roots, depth=None):
+    "The subgraph of things leading to any of roots, visiting each node once"
+    index = indexed(graph)
+    ids = index.root_ids(roots)
+    found, expanded = index.search(index.reverse, ids, depth)
+    result = Graph(nodes=[index.names[n] for n in found], edges={})
+    result['nodes'].extend(set(roots) - index.ids.keys())
+    for node in expanded:
+        name = index.names[node]
+        for label, source in index.reverse.edges(node):
+            result['edges'].setdefault(index.names[source], []).append((index.label_names[label], name))
+    return result
 
 def reverse_graph(graph):
-    result = dict()
+    result = Graph()
     result['nodes'] = list(graph['nodes'])
     result['edges'] = dict()
     for source in graph['edges']:
@@ -60,74 +675,115 @@ def reverse_graph(graph):
     return result
 
 def after_graph(graph, root, depth=None):
-    result = dict(edges={}, nodes=set())
+    return after_graphs(graph, [root], depth)
 
-    visited = set()
+def after_graphs(graph, roots, depth=None):
+    "The subgraph of things reachable from any of roots, visiting each node once"
+    index = indexed(graph)
+    ids = index.root_ids(roots)
+    found, expanded = index.search(index.forward, ids, depth)
+    result = Graph(edges={}, nodes=set(index.names[n] for n in found))
+    for node in expanded:
+        name = index.names[node]
+        result['edges'][name] = list(graph['edges'].get(name, []))
 
-    depths = range(depth) if depth is not None else itertools.count()
-
-    border = set([root])
-    result['nodes'].update(border)
-    for _ in depths:
-        new_border = set()
-        for x in border:
-            result['edges'].setdefault(x, set())
-            result['edges'][x] = list(graph['edges'].get(x, []))
-            for _, target in result['edges'][x]:
-                new_border.add(target)
+    for root in set(roots) - index.ids.keys():
+        result['nodes'].add(root)
+        if depth != 0:
+            result['edges'][root] = []
+    return result
 
-        new_border -= visited
-        result['nodes'].update(new_border)
-        visited |= new_border
-        if not new_border:
-            break
+def strictly_before(graph, roots):
+    "Nodes leading to a root other than themselves"
+    reachable = reachability(graph)
+    if reachable is not None:
+        return reachable.strictly_before(roots)
+    index = indexed(graph)
+    return set(index.names[n] for n in index.strict_search(index.reverse, index.root_ids(roots)))
 
-        border = new_border
-    return result
+def strictly_after(graph, roots):
+    "Nodes reachable from a root other than themselves"
+    reachable = reachability(graph)
+    if reachable is not None:
+        return reachable.strictly_after(roots)
+    index = indexed(graph)
+    return set(index.names[n] for n in index.strict_search(index.forward, index.root_ids(roots)))
 
 def contract_graph(graph, kept_nodes):
+    """Keep only kept_nodes, with implicit edges for paths through the
+    nodes that are removed.
+
+    The removed nodes are grouped into strongly connected components, and
+    the kept nodes reached from each component are found once, as a
+    bitset of kept nodes, from the components after it"""
     # ignore labels for the moment
-    result = dict(edges={}, nodes=set())
+    result = Graph(edges={}, nodes=set())
+    index = indexed(graph)
+    starts = index.forward.starts
+    ends = index.forward.ends
+    targets = index.forward.targets
 
     kept_nodes = kept_nodes & set(graph["nodes"])
+    kept_ids = sorted(index.ids[node] for node in kept_nodes)
+    kept = index.bitmap(kept_nodes)
+    removed = bytearray(b'\x01') * len(index.names)
+    # Bit for each kept node
+    bit = dict()
+    for number, node in enumerate(kept_ids):
+        removed[node] = 0
+        bit[node] = 1 << number
+
+    # The kept nodes reached from each component of removed nodes
+    entries = [target for node in kept_ids for target in targets[starts[node]:ends[node]] if removed[target]]
+    component, count = strong_components(index.forward, entries, removed)
+    members = [[] for _ in range(count)]
+    for node, node_component in enumerate(component):
+        if node_component != -1:
+            members[node_component].append(node)
 
-    for node in kept_nodes:
-        result['nodes'].add(node)
-        pseudo_neighbours = set([node])
+    reached = []
+    for number in range(count):
+        mask = 0
+        for node in members[number]:
+            for target in targets[starts[node]:ends[node]]:
+                if kept[target]:
+                    mask |= bit[target]
+                elif component[target] != number:
+                    mask |= reached[component[target]]
+        reached.append(mask)
 
-        for label, neighbour in graph['edges'].get(node, []):
-            if neighbour in kept_nodes:
-                result['edges'].setdefault(node, [])
+    for node in kept_ids:
+        name = index.names[node]
+        result['nodes'].add(name)
+        direct = implied = 0
+        for label, target in index.forward.edges(node):
+            if kept[target]:
                 # Maintain labels for not implied edges
-                result['edges'][node].append((label, neighbour))
-
-        visited = set()
-        while pseudo_neighbours - visited:
-            border = set()
-            for base in pseudo_neighbours - visited:
-                for _, target in graph['edges'].get(base, []):
-                    if target in kept_nodes:
-                        result['edges'].setdefault(node, [])
-                        if target not in [t for _, t in result['edges'].get(node, [])]:
-                            result['edges'][node].append((IMPLICIT, target))
-                    else:
-                        border.add(target)
-            visited |= pseudo_neighbours
-            pseudo_neighbours |= border
+                result['edges'].setdefault(name, []).append((index.label_names[label], index.names[target]))
+                direct |= bit[target]
+            else:
+                implied |= reached[component[target]]
+
+        for number in bit_positions(implied & ~direct):
+            result['edges'].setdefault(name, []).append((IMPLICIT, index.names[kept_ids[number]]))
     return result
 
 def induce_graph(graph, nodes):
-    result = dict(edges={}, nodes=set(nodes))
+    result = Graph(edges={}, nodes=set(nodes))
+    index = indexed(graph)
+    included = index.bitmap(nodes)
 
     for n in nodes:
-        result['edges'][n] = [
-            (l, target)
-            for l, target in graph["edges"].get(n, []) if target in nodes]
+        result['edges'][n] = []
+        if n in index.ids:
+            for label, target in index.forward.edges(index.ids[n]):
+                if included[target]:
+                    result['edges'][n].append((index.label_names[label], index.names[target]))
 
     return result
 
 def remove_label(graph, label):
-    result = dict(edges={}, nodes=set(graph["nodes"]))
+    result = Graph(edges={}, nodes=set(graph["nodes"]))
     for node in graph['edges']:
         result["edges"][node] = [(l, x) for l, x in  graph['edges'][node] if l != label]
 
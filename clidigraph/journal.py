@@ -0,0 +1,67 @@
+"""An append-only journal of changes stored next to a graph's json file.
+
+The first line of the journal names the generation of the snapshot (the json
+file) that it applies to. Each following line is a change recorded by
+datastore. Journals for other generations are stale and ignored."""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import logging
+import os
+
+LOGGER = logging.getLogger('journal')
+
+
+def journal_path(data_file):
+    return data_file + '.journal'
+
+def new_generation():
+    return os.urandom(16).hex()
+
+def read(data_file, generation):
+    "Yield the changes in the journal for a snapshot"
+    path = journal_path(data_file)
+    if not os.path.exists(path):
+        return
+
+    with open(path) as stream:
+        header = stream.readline()
+        if not header.endswith('\n') or json.loads(header)['generation'] != generation:
+            LOGGER.debug('Ignoring stale journal %r', path)
+            return
+
+        for line in stream:
+            if not line.endswith('\n'):
+                # Partially written by a process that died
+                LOGGER.debug('Ignoring incomplete journal entry %r', line)
+                break
+            yield json.loads(line)
+
+def append(data_file, generation, changes):
+    "Append changes to the journal. Returns the size of the journal"
+    path = journal_path(data_file)
+    lines = [json.dumps(change) + '\n' for change in changes]
+    if not is_current(path, generation):
+        lines.insert(0, json.dumps(dict(generation=generation)) + '\n')
+        mode = 'w'
+    else:
+        mode = 'a'
+
+    with open(path, mode) as stream:
+        stream.write(''.join(lines))
+        stream.flush()
+        os.fsync(stream.fileno())
+        return stream.tell()
+
+def is_current(path, generation):
+    if not os.path.exists(path):
+        return False
+    with open(path) as stream:
+        header = stream.readline()
+    return header.endswith('\n') and json.loads(header)['generation'] == generation
+
+def remove(data_file):
+    path = journal_path(data_file)
+    if os.path.exists(path):
+        os.unlink(path)
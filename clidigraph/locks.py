@@ -0,0 +1,68 @@
+"""Reader-writer locks for threads and for processes.
+
+These take the same fcntl locks on the lock file as the fasteners package,
+which older versions used, but without the cost of importing it."""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import contextlib
+import fcntl
+import threading
+
+
+class ReaderWriterLock(object):
+    "Any number of threads can hold the read lock, or a single thread the write lock"
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+
+    @contextlib.contextmanager
+    def read_lock(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writing)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def write_lock(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writing and not self._readers)
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class InterProcessReaderWriterLock(object):
+    """A reader-writer lock on a file shared between processes.
+    Threads in one process share the lock so also need a lock of their own"""
+    def __init__(self, path):
+        self.path = path
+
+    @contextlib.contextmanager
+    def read_lock(self):
+        with self._locked(fcntl.LOCK_SH):
+            yield
+
+    @contextlib.contextmanager
+    def write_lock(self):
+        with self._locked(fcntl.LOCK_EX):
+            yield
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        with open(self.path, 'a+') as stream:
+            fcntl.lockf(stream, operation)
+            try:
+                yield
+            finally:
+                fcntl.lockf(stream, fcntl.LOCK_UN)
@@ -0,0 +1,118 @@
+"""A cache on disk of the results of queries for each version of a graph.
+
+The version of a graph is the signature of its store, which changes every
+time the graph is saved. Each entry is a file in a directory next to the
+graph named by a hash of the version and a key. Entries are never out of
+date, just unused once the graph changes: the least recently used are
+removed once the entries take up more than the query-cache-size setting."""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import functools
+import hashlib
+import marshal
+import os
+import shutil
+import sys
+
+CACHE_SIZE = 64 * 1024 * 1024
+
+# Changes to this invalidate all entries
+FORMAT = (1, tuple(sys.version_info[:2]), marshal.version)
+
+@functools.lru_cache(None)
+def code_version():
+    """A hash of the source of the package. Entries are rendered by the code,
+    so are not used after it changes, such as by an upgrade"""
+    digest = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            with open(os.path.join(directory, name), 'rb') as stream:
+                digest.update(name.encode('utf8') + b'\0' + stream.read())
+    return digest.hexdigest()
+
+
+def cache_directory(data_file):
+    return data_file + '.query-cache'
+
+def cache_size(settings):
+    "The number of bytes the cache may use. 0 if it is turned off"
+    return int(settings.get('query-cache-size', CACHE_SIZE))
+
+
+class QueryCache(object):
+    def __init__(self, data_file):
+        self.directory = cache_directory(data_file)
+
+    def path(self, version, key):
+        digest = hashlib.sha1(repr((FORMAT, code_version(), version, key)).encode('utf8')).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def get(self, version, key):
+        "The value stored for key in a version of the graph, or None"
+        path = self.path(version, key)
+        try:
+            with open(path, 'rb') as stream:
+                value = marshal.load(stream)
+        except (FileNotFoundError, EOFError, ValueError):
+            return None
+        # Modification times order entries by when they were last used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def put(self, version, key, value, size):
+        "Store a value, removing the least recently used entries if the cache is over size bytes"
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(version, key)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as stream:
+                marshal.dump(value, stream)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        self.evict(size)
+
+    def entries(self):
+        "(path, stat) for each entry, least recently used first"
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        result = []
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                result.append((path, os.stat(path)))
+            except FileNotFoundError:
+                pass
+        result.sort(key=lambda entry: entry[1].st_mtime_ns)
+        return result
+
+    def evict(self, size):
+        entries = self.entries()
+        total = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if total <= size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= stat.st_size
+
+    def stats(self):
+        "(number of entries, bytes used)"
+        entries = self.entries()
+        return len(entries), sum(stat.st_size for _, stat in entries)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,5 +1,5 @@
-import graphviz
 import logging
+import re
 
 LOGGER = logging.getLogger('render')
 
@@ -7,16 +7,49 @@ LOGGER = logging.getLogger('render')
 from . import graphs
 
 HIGHLIGHT_COLOR = 'yellow'
+
+# Colors can be found here:
+# http://graphviz.org/doc/info/colors.html
+COLORS = ('pink', 'lightgreen', 'lightblue', 'bisque', 'orange', 'green')
+
+# Identifiers that graphviz reads without quotes
+DOT_ID = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*|-?(\.[0-9]+|[0-9]+(\.[0-9]*)?))$')
+DOT_KEYWORDS = {'node', 'edge', 'graph', 'digraph', 'subgraph', 'strict'}
+# A quote with any escaping backslash, so that \" and " are both written as \"
+DOT_QUOTE = re.compile(r'((?:\\\\)*)\\?"')
+
 def render_graph(data, graph, highlighted_nodes, grouped_nodes):
-    rendered_nodes = set()
-    graphviz_graph = graphviz.Digraph()
+    "The dot source for graph"
+    return ''.join(render_lines(data, graph, highlighted_nodes, grouped_nodes))
+
+def write_graph(stream, data, graph, highlighted_nodes, grouped_nodes):
+    "Write the dot source for graph to stream as it is produced"
+    stream.writelines(render_lines(data, graph, highlighted_nodes, grouped_nodes))
+
+def render_lines(data, graph, highlighted_nodes, grouped_nodes):
+    "Lines of dot source for graph"
+    highlighted_nodes = set(highlighted_nodes)
+
+    # node -> names of the groups that it is in
+    node_groups = dict()
+    for group_name, nodes in grouped_nodes.items():
+        for name in nodes:
+            node_groups.setdefault(name, []).append(group_name)
+
+    # Colors are only checked for when they are needed
+    colors = None
+    def get_color(tag):
+        nonlocal colors
+        if colors is None:
+            colors = tag_colors(data['tags'], grouped_nodes)
+        return colors[tag]
 
     def render_node(name):
         node_info = data['node_info'].get(name, dict())
 
         tags = node_info.get('tags')
 
-        tag = sorted(tags)[0] if tags else None
+        tag = min(tags) if tags else None
         kwargs = dict()
 
         if tag:
@@ -24,75 +57,88 @@ def render_graph(data, graph, highlighted_nodes, grouped_nodes):
         else:
             kwargs["tooltip"] = ''
 
-        if name in (set.union(*grouped_nodes.values()) if grouped_nodes else set()):
-            for group_name, nodes in grouped_nodes.items():
-                if name in nodes:
-                    kwargs["fillcolor"] = get_tag_color(group_name, grouped_nodes, data)
-                    kwargs["style"] = 'filled'
-                    break
-            else:
-                raise Exception('unreachable')
+        groups = node_groups.get(name)
+        if groups:
+            kwargs["fillcolor"] = get_color(groups[0])
+            kwargs["style"] = 'filled'
         elif name in highlighted_nodes:
             kwargs["fillcolor"] = HIGHLIGHT_COLOR
             kwargs["style"] = 'filled'
         elif tag:
-            kwargs["fillcolor"] = get_tag_color(tag, grouped_nodes, data)
+            kwargs["fillcolor"] = get_color(tag)
             kwargs["style"] = 'filled'
 
         if name in highlighted_nodes:
             kwargs["tooltip"] += '\nhighlighted\n'
 
-        if name in (set.union(*grouped_nodes.values()) if grouped_nodes else set()):
-            for group_name, nodes in grouped_nodes.items():
-                if name in nodes:
-                    kwargs["tooltip"] += '\ngroup:' + group_name
+        for group_name in groups or ():
+            kwargs["tooltip"] += '\ngroup:' + group_name
 
         if node_info.get('note', None):
             kwargs['peripheries'] = '2'
 
         LOGGER.debug('Color of %r %r %r', name, tag, kwargs)
-        return graphviz_graph.node(name, **kwargs)
+        return '\t{}{}\n'.format(dot_quote(name), dot_attributes(kwargs))
+
+    yield 'digraph {\n'
 
+    rendered_nodes = set()
     for node in graph['nodes']:
         if node not in rendered_nodes:
             rendered_nodes.add(node)
-            render_node(node)
+            yield render_node(node)
 
     for source in graph['edges']:
         if source not in rendered_nodes:
             rendered_nodes.add(source)
-            render_node(source)
+            yield render_node(source)
 
+        quoted_source = dot_quote(source)
         for (label, target) in graph['edges'][source]:
 
             if target not in rendered_nodes:
                 rendered_nodes.add(target)
-                render_node(target)
+                yield render_node(target)
 
             if label == graphs.DEFAULT:
-                graphviz_graph.edge(source, target)
+                attributes = ''
             elif label == graphs.IMPLICIT:
-                graphviz_graph.edge(source, target, style='dashed')
+                attributes = ' [style=dashed]'
             else:
-                graphviz_graph.edge(source, target, label=label)
-
-    return graphviz_graph.source
-
-def get_tag_color(tag, groups, data):
+                attributes = ' [label={}]'.format(dot_quote(label))
+            yield '\t{} -> {}{}\n'.format(quoted_source, dot_quote(target), attributes)
+
+    yield '}\n'
+
+def dot_quote(identifier):
+    "identifier as dot reads it, quoted if needed"
+    if DOT_ID.match(identifier) and identifier.lower() not in DOT_KEYWORDS:
+        return identifier
+    return '"{}"'.format(DOT_QUOTE.sub(r'\1\\"', identifier))
+
+def dot_attributes(attributes):
+    "A dot attribute list, in order of name"
+    if not attributes:
+        return ''
+    return ' [{}]'.format(' '.join(
+        '{}={}'.format(key, dot_quote(value)) for key, value in sorted(attributes.items())))
+
+def tag_colors(tags, groups):
+    "The fill color for each tag and group"
     groups = set(groups)
-    tags = sorted(data['tags'])
+    tags = sorted(tags)
 
     if groups & set(tags):
         raise ValueError(groups & set(tags))
-    # Colors can be found here:
-    # http://graphviz.org/doc/info/colors.html
-    colors = ('pink', 'lightgreen', 'lightblue', 'bisque', 'orange', 'green')
 
-    if HIGHLIGHT_COLOR in colors:
-        raise ValueError((HIGHLIGHT_COLOR, colors))
+    if HIGHLIGHT_COLOR in COLORS:
+        raise ValueError((HIGHLIGHT_COLOR, COLORS))
 
     required_colors = set(tags) | set(groups)
-    if len(required_colors) > len(colors):
+    if len(required_colors) > len(COLORS):
         raise Exception('Too many colors {}'.format(required_colors))
 
-    return dict(zip(sorted(tags) + sorted(groups), colors))[tag]
+    return dict(zip(tags + sorted(groups), COLORS))
+
+def get_tag_color(tag, groups, data):
+    return tag_colors(data['tags'], groups)[tag]
@@ -0,0 +1,115 @@
+"Keep a graph loaded in a process and answer commands over a unix socket"
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import contextlib
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+
+LOGGER = logging.getLogger('server')
+
+
+def socket_path(data_file):
+    return data_file + '.sock'
+
+def request(data_file, argv):
+    "Run a command with a server. Returns the exit status or None if there is no server"
+    path = socket_path(data_file)
+    if not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with contextlib.closing(sock):
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            LOGGER.debug('No server listening on %r', path)
+            return None
+
+        sock.sendall(json.dumps(dict(argv=argv, data_file=data_file)).encode('utf8') + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('rb') as stream:
+            response = json.loads(stream.read().decode('utf8'))
+
+    print(response['stdout'], end='')
+    print(response['stderr'], end='', file=sys.stderr)
+    return response['status']
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line.strip():
+            # request_possible connects without sending a request
+            return
+        message = json.loads(line.decode('utf8'))
+        LOGGER.debug('Request %r', message)
+
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = run_captured(self.server.run_request, message['argv'], message['data_file'])
+
+        response = dict(stdout=stdout.getvalue(), stderr=stderr.getvalue(), status=status)
+        self.wfile.write(json.dumps(response).encode('utf8') + b'\n')
+
+def run_captured(run_request, argv, data_file):
+    """Run a request turning exits and exceptions into an exit status.
+    data_file is the graph the client found from its arguments and working directory"""
+    try:
+        return run_request(argv, data_file) or 0
+    except SystemExit as ex:
+        if ex.code is None or isinstance(ex.code, int):
+            return ex.code or 0
+        print(ex.code, file=sys.stderr)
+        return 1
+    except Exception: # pylint: disable=broad-except
+        traceback.print_exc()
+        return 1
+
+
+class GraphServer(socketserver.UnixStreamServer):
+    "Answer requests one at a time. Requests share the process's stdout so cannot run concurrently"
+    def __init__(self, path, run_request):
+        self.run_request = run_request
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+
+def serve(data_file, run_request):
+    path = socket_path(data_file)
+    if request_possible(path):
+        raise Exception('A server is already running on {!r}'.format(path))
+
+    if os.path.exists(path):
+        os.unlink(path)
+
+    old_umask = os.umask(0o077)
+    try:
+        server = GraphServer(path, run_request)
+    finally:
+        os.umask(old_umask)
+
+    LOGGER.debug('Serving %r on %r', data_file, path)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+def request_possible(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with contextlib.closing(sock):
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+        return True
@@ -2,26 +2,30 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import re
+import collections
+import functools
+import time
 
-from . import graphs, datastore
+from . import graphs, datastore, timings
 
 
 def get_node(data, source):
     if source.startswith('raw:'):
-        result, = [n for n in data['nodes'] if n == source.split(':', 1)[1]]
+        result = source.split(':', 1)[1]
+        if result not in graphs.names(data):
+            raise ValueError(result)
     else:
-        result, = [n for n in data['nodes'] if re.search(source, n)]
+        result, = graphs.names(data).search(source)
     return result
 
-def get_matching_edges(data, graph, specifier):
+def get_matching_edges(data, graph, specifier, query=None):
     head, rest = specifier.split(':', 1)
     result = []
     if head == 'to':
-        nodes = get_matching_nodes(data, graph, rest)
-        backward = graphs.reverse_graph(data)
+        nodes = get_matching_nodes(data, graph, rest, query)
+        backward = graphs.predecessors(data)
         for node in nodes:
-            for label, target in backward['edges'][node]:
+            for label, target in backward.get(node, []):
                 result.append((target, label, node))
     else:
         raise NotImplementedError(head)
@@ -29,79 +33,261 @@ def get_matching_edges(data, graph, specifier):
 
 
 class SpecifierMatch(object):
-    def __init__(self, data, graph):
-        self.data = data
+    """The nodes for each kind of specifier, given its parsed arguments.
+
+    Specifiers within a specifier are evaluated by query"""
+    def __init__(self, query, graph):
+        self.query = query
+        self.data = query.data
         self.graph = graph
 
-    def get_neighbour(self, rest):
-        depth, root_specifier = rest.split(':', 1)
-        root_nodes = get_matching_nodes(self.data, self.graph, root_specifier)
-        return set(graphs.merge_graphs(*[
-            neighbour_graph(self.graph, root, depth)
-            for root in root_nodes])["nodes"]) - set(root_nodes)
-
-    def get_not(self, rest):
-        return set(self.graph["nodes"]) - get_matching_nodes(self.data, self.graph, rest)
-
-    def get_strict_before(self, rest):
-        bases = get_matching_nodes(self.data, self.graph, rest)
-        nodes = set()
-        for b in bases:
-            nodes |= (set(graphs.before_graph(self.graph, b)['nodes']) - set([b]))
-        return nodes
-
-    def get_strict_after(self, rest):
-        bases = get_matching_nodes(self.data, self.graph, rest)
-        nodes = set()
-        for b in bases:
-            nodes |= (graphs.after_graph(self.graph, b)['nodes']  - set([b]))
-        return nodes
-
-    def get_between(self, rest):
-        from_spec, to_spec = rest.split('::')
-        to_nodes = get_matching_nodes(self.data, self.graph, to_spec)
-        from_nodes = get_matching_nodes(self.data, self.graph, from_spec)
+    def nodes(self, expression):
+        return self.query.evaluate(self.graph, expression)
+
+    def get_neighbour(self, depth, root_expression):
+        root_nodes = self.nodes(root_expression)
+        return set(neighbour_graph(self.graph, root_nodes, depth)["nodes"]) - root_nodes
+
+    def get_not(self, expression):
+        return set(self.graph["nodes"]) - self.nodes(expression)
+
+    def get_strict_before(self, expression):
+        return graphs.strictly_before(self.graph, self.nodes(expression))
+
+    def get_strict_after(self, expression):
+        return graphs.strictly_after(self.graph, self.nodes(expression))
+
+    def get_between(self, from_expression, to_expression):
+        to_nodes = self.nodes(to_expression)
+        from_nodes = self.nodes(from_expression)
         return graphs.between_graph(self.graph, from_nodes, to_nodes)["nodes"]
 
-    def get_after(self, rest):
-        bases = get_matching_nodes(self.data, self.graph, rest)
-        return graphs.merge_graphs(*(graphs.after_graph(self.graph, b) for b in bases))["nodes"]
+    def get_after(self, expression):
+        return graphs.after_graphs(self.graph, self.nodes(expression))["nodes"]
 
-    def get_before(self, rest):
-        bases = get_matching_nodes(self.data, self.graph, rest)
-        before_graph = graphs.merge_graphs(*(graphs.before_graph(self.graph, b) for b in bases))
-        return set(before_graph['nodes'])
+    def get_before(self, expression):
+        return set(graphs.before_graphs(self.graph, self.nodes(expression))['nodes'])
 
-    def get_root(self, rest):
-        del rest
+    def get_root(self):
         return get_roots(self.graph)
 
-    def get_tag(self, rest):
-        return get_nodes(self.data, self.graph, tag=rest)
+    def get_tag(self, tag):
+        return get_nodes(self.data, self.graph, tag=tag)
 
     @classmethod
     def specifiers(cls):
         return [method[len('get_'):].replace('_', '-') for method in dir(cls) if method.startswith('get_')]
 
 
-def get_matching_nodes(data, graph, specifier):
+@functools.lru_cache(maxsize=None)
+def compile_specifier(specifier):
+    """Parse a specifier into an expression: a tuple of its kind followed by its arguments.
+    Arguments that are specifiers are expressions themselves.
+
+    Kinds are the specifiers and 'raw', 'union' and 'regex'"""
     if specifier.startswith('raw:'):
-        single, = [n for n in graph["nodes"] if n == specifier.split(':')[1]]
-        return set([single])
+        return ('raw', specifier.split(':')[1])
 
     if ',' in specifier:
-        return set.union(*map(set, (get_matching_nodes(data, graph, s) for s in specifier.split(','))))
-    result = set()
+        return union_expression(compile_specifier(s) for s in specifier.split(','))
 
     if ':' in specifier:
         head, rest = specifier.split(':', 1)
-        spec = SpecifierMatch(data, graph)
-        return getattr(spec, 'get_' + head.replace('-', '_'))(rest)
-    else:
-        result |= set([node for node in graph['nodes'] if re.search(specifier, node)])
+        kind = head.replace('-', '_')
+        if not hasattr(SpecifierMatch, 'get_' + kind):
+            raise ValueError(specifier)
+        elif kind == 'neighbour':
+            depth, root_specifier = rest.split(':', 1)
+            return (kind, depth, compile_specifier(root_specifier))
+        elif kind == 'between':
+            from_spec, to_spec = rest.split('::')
+            return (kind, compile_specifier(from_spec), compile_specifier(to_spec))
+        elif kind == 'root':
+            return (kind,)
+        elif kind == 'tag':
+            return (kind, rest)
+        else:
+            return (kind, compile_specifier(rest))
+    return ('regex', specifier)
+
+def union_expression(expressions):
+    "An expression for the union of expressions, in a normal form"
+    parts = set()
+    for expression in expressions:
+        if expression[0] == 'union':
+            parts.update(expression[1])
+        else:
+            parts.add(expression)
+    if len(parts) == 1:
+        return parts.pop()
+    return ('union', tuple(sorted(parts)))
+
+def subexpressions(expression):
+    if expression[0] == 'union':
+        return expression[1]
+    return [argument for argument in expression[1:] if isinstance(argument, tuple)]
+
+# Kinds of expression whose nodes depend on edges
+TRAVERSALS = ('after', 'before', 'between', 'neighbour', 'root', 'strict_after', 'strict_before')
+
+def depends_on(expression):
+    "The parts of the data ('nodes', 'edges' and 'tags') that the nodes for an expression depend on"
+    result = set(['nodes'])
+    if expression[0] in TRAVERSALS:
+        result.add('edges')
+    elif expression[0] == 'tag':
+        result.add('tags')
+    for subexpression in subexpressions(expression):
+        result |= depends_on(subexpression)
     return result
 
-def neighbour_graph(graph, root, depth):
+def unchanged_results(results, changed):
+    "The results, expression -> nodes, that are the same after the parts of the data in changed change"
+    return {expression: nodes for expression, nodes in results.items() if not depends_on(expression) & changed}
+
+def describe_expression(expression):
+    return ' '.join(
+        [expression[0].replace('_', '-')] + [argument for argument in expression[1:] if not isinstance(argument, tuple)])
+
+
+class Query(object):
+    """Evaluates specifiers for a command.
+
+    Specifiers are compiled to expressions. The nodes for each expression
+    are remembered so that expressions shared between specifiers are
+    evaluated once. Nodes for expressions on data can be given in saved,
+    for instance from an earlier command on the same version of data."""
+    def __init__(self, data, saved=None):
+        self.data = data
+        # expression -> nodes in data
+        self.saved = saved or dict()
+        # (id(graph), expression) -> nodes. Graphs are kept so that ids are not reused
+        self.results = dict()
+        self.graphs = dict()
+        # Details for explain
+        self.requests = []
+        self.seconds = dict()
+        self.uses = collections.Counter()
+
+    def nodes(self, graph, specifier):
+        "The nodes in graph matching a specifier"
+        with timings.phase('specifier ' + specifier) as phase:
+            expression = compile_specifier(specifier)
+            self.requests.append((specifier, graph, expression))
+            result = set(self.evaluate(graph, expression))
+            phase.nodes(result)
+        return result
+
+    def evaluate(self, graph, expression):
+        "The nodes for an expression. These must not be changed"
+        key = (id(graph), expression)
+        self.uses[key] += 1
+        if key not in self.results:
+            self.graphs[id(graph)] = graph
+            start = time.perf_counter()
+            if graph is self.data and expression in self.saved:
+                self.results[key] = set(self.saved[expression])
+            else:
+                self.results[key] = set(self.compute(graph, expression))
+            self.seconds[key] = time.perf_counter() - start
+        return self.results[key]
+
+    def evaluate_parallel(self, specifiers, jobs):
+        """Evaluate the terms of specifiers on data in up to jobs processes,
+        so that later calls to nodes() use the results.
+
+        Processes are forked so they share data without copying it. Indexes
+        are built first so that each process does not build its own"""
+        expressions = set()
+        for specifier in specifiers:
+            expression = compile_specifier(specifier)
+            expressions.update(expression[1] if expression[0] == 'union' else [expression])
+        pending = sorted(
+            expression for expression in expressions
+            if (id(self.data), expression) not in self.results and expression not in self.saved)
+        # Connections to a database cannot be shared with forked processes
+        if jobs < 2 or len(pending) < 2 or isinstance(self.data, datastore.SqliteGraphData):
+            return
+
+        with timings.phase('parallel specifiers') as phase:
+            parts = set.union(*(depends_on(expression) for expression in pending))
+            graphs.names(self.data)
+            if 'edges' in parts:
+                graphs.indexed(self.data)
+                graphs.reachability(self.data)
+            if 'tags' in parts:
+                datastore.tagged(self.data)
+
+            import multiprocessing
+            global WORKER_DATA
+            WORKER_DATA = self.data
+            try:
+                with multiprocessing.get_context('fork').Pool(min(jobs, len(pending))) as pool:
+                    evaluated = pool.map(evaluate_in_worker, pending, chunksize=1)
+            finally:
+                WORKER_DATA = None
+
+            self.graphs[id(self.data)] = self.data
+            # In the order of pending so that results do not depend on which process finished first
+            for results in evaluated:
+                for expression, nodes, seconds in results:
+                    key = (id(self.data), expression)
+                    if key not in self.results:
+                        self.results[key] = nodes
+                        self.seconds[key] = seconds
+            phase.nodes(set.union(*(self.results[(id(self.data), expression)] for expression in pending)))
+
+    def data_results(self):
+        "expression -> nodes for each expression evaluated on data, for saved"
+        return {
+            expression: nodes for (graph_id, expression), nodes in self.results.items()
+            if graph_id == id(self.data)}
+
+    def compute(self, graph, expression):
+        kind, arguments = expression[0], expression[1:]
+        if kind == 'raw':
+            single, = arguments
+            if single not in graphs.names(graph):
+                raise ValueError(single)
+            return set([single])
+        elif kind == 'union':
+            parts, = arguments
+            return set.union(*(self.evaluate(graph, part) for part in parts))
+        elif kind == 'regex':
+            pattern, = arguments
+            return graphs.names(graph).search(pattern)
+        else:
+            return getattr(SpecifierMatch(self, graph), 'get_' + kind)(*arguments)
+
+    def explain(self, stream):
+        "Write each expression evaluated with its timing"
+        for specifier, graph, expression in self.requests:
+            stream.write('{}\n'.format(specifier))
+            self.explain_expression(stream, graph, expression, 1)
+
+    def explain_expression(self, stream, graph, expression, depth):
+        key = (id(graph), expression)
+        stream.write('{}{}: {} nodes, {:.2f}ms{}\n'.format(
+            '  ' * depth, describe_expression(expression), len(self.results[key]),
+            self.seconds[key] * 1000, ', used {} times'.format(self.uses[key]) if self.uses[key] > 1 else ''))
+        for subexpression in subexpressions(expression):
+            self.explain_expression(stream, graph, subexpression, depth + 1)
+
+
+# The data that forked processes evaluate expressions on
+WORKER_DATA = None
+
+def evaluate_in_worker(expression):
+    "(expression, nodes, seconds) for expression and each expression within it, on WORKER_DATA"
+    query = Query(WORKER_DATA)
+    query.evaluate(WORKER_DATA, expression)
+    return [(key[1], nodes, query.seconds[key]) for key, nodes in query.results.items()]
+
+def get_matching_nodes(data, graph, specifier, query=None):
+    "Nodes matching specifier. query can be shared between calls so that results are reused"
+    return (query or Query(data)).nodes(graph, specifier)
+
+def neighbour_graph(graph, roots, depth):
     if depth.startswith('+'):
         down_depth = int(depth[1:])
         up_depth = 0
@@ -112,8 +298,8 @@ def neighbour_graph(graph, root, depth):
         up_depth = down_depth = int(depth)
 
     return graphs.merge_graphs(
-        graphs.before_graph(graph, root, depth=up_depth),
-        graphs.after_graph(graph, root, depth=down_depth),
+        graphs.before_graphs(graph, roots, depth=up_depth),
+        graphs.after_graphs(graph, roots, depth=down_depth),
         )
 
 def get_nodes(data, graph, tag=None):
@@ -121,10 +307,10 @@ def get_nodes(data, graph, tag=None):
     if tag is None:
         raise ValueError(tag)
 
-    for name, info in data['node_info'].items():
-        if tag in info.get('tags', list()):
-            if name in graph['nodes']:
-                yield name
+    names = graphs.names(graph)
+    for name in datastore.tagged(data).nodes(tag):
+        if name in names:
+            yield name
 
 def get_roots(data):
     nodes = set(data["nodes"])
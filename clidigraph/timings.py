@@ -0,0 +1,87 @@
+"""Timing the phases of a command, for --timings.
+
+Phases are only recorded between start() and stop(). Otherwise phase()
+returns an object that does nothing, so timing costs nothing when it is off."""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+
+
+class Phase(object):
+    "A part of a command being timed, with the sizes of what it worked on"
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.sizes = []
+        self.seconds = None
+        self.start = None
+
+    def __enter__(self):
+        STACK.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.seconds = time.perf_counter() - self.start
+        STACK.pop()
+        return False
+
+    def graph(self, graph):
+        self.sizes.append('{} nodes, {} edges'.format(
+            len(graph.get('nodes', ())), sum(len(edges) for edges in graph.get('edges', dict()).values())))
+
+    def nodes(self, nodes):
+        self.sizes.append('{} nodes'.format(len(nodes)))
+
+    def describe(self):
+        seconds = 'unfinished' if self.seconds is None else '{:.2f}ms'.format(self.seconds * 1000)
+        return '{}{}: {}'.format('  ' * self.depth, self.name, ', '.join([seconds] + self.sizes))
+
+
+class NoPhase(object):
+    "A phase when timing is off"
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def graph(self, graph):
+        pass
+
+    def nodes(self, nodes):
+        pass
+
+NO_PHASE = NoPhase()
+
+# Phases in the order that they started, or None if timing is off
+PHASES = None
+# Phases that have started but not finished
+STACK = []
+
+
+def start():
+    global PHASES
+    PHASES = []
+    del STACK[:]
+
+def stop():
+    "Stop timing. Returns the phases that were timed"
+    global PHASES
+    result, PHASES = PHASES, None
+    return result
+
+def phase(name):
+    "A context manager timing a phase. Phases started while it runs are part of it"
+    if PHASES is None:
+        return NO_PHASE
+    result = Phase(name, len(STACK))
+    PHASES.append(result)
+    return result
+
+def report(stream, phases, seconds):
+    "Write each phase with its time and sizes, indented within the phase it was part of"
+    for timed in phases:
+        stream.write(timed.describe() + '\n')
+    stream.write('total: {:.2f}ms\n'.format(seconds * 1000))
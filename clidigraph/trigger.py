@@ -0,0 +1,160 @@
+"""Running the trigger command after a graph changes.
+
+The trigger is given the changes on stdin, one json list per line in the
+format of the journal, such as ["add_edge", "a", "default", "b"]. If the
+changes are not known, because the graph was rewritten or the trigger was
+run by hand, it is given the single line ["rewrite"].
+
+With the trigger-mode setting set to async, changes are queued in a file
+next to the graph and a background process runs the trigger once no changes
+have been queued for trigger-debounce seconds. Only one trigger runs at a
+time for each graph. If that process dies before running the trigger, the
+next change starts another, which runs the trigger for the changes it left."""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from . import locks
+
+LOGGER = logging.getLogger('trigger')
+
+DEBOUNCE = 0.5
+
+REWRITE = ['rewrite']
+
+# Threads in a server share the file lock
+QUEUE_LOCK = threading.Lock()
+
+# Runners started by this process: pid -> process
+RUNNERS = dict()
+
+
+def pending_path(data_file):
+    return data_file + '.trigger'
+
+def runner_path(data_file):
+    "A file holding the pid of the process started to run the trigger for queued changes"
+    return data_file + '.trigger.pid'
+
+def log_path(data_file):
+    return data_file + '.trigger.log'
+
+def summary(changes):
+    "The lines given to the trigger for changes, which are None if not known"
+    if changes is None or REWRITE in changes:
+        changes = [REWRITE]
+    return ''.join(json.dumps(change) + '\n' for change in changes)
+
+def environment(data_file):
+    return dict(os.environ, CLIDIGRAPH_GRAPH=data_file)
+
+def run_trigger(data_file, settings, changes):
+    "Run the trigger for changes now, or queue them if the trigger is asynchronous"
+    if settings.get('trigger-mode') == 'async':
+        queue(data_file, settings, changes)
+    else:
+        import subprocess
+        subprocess.run(
+            settings['trigger'], shell=True, input=summary(changes), universal_newlines=True,
+            env=environment(data_file), check=True)
+
+def queue(data_file, settings, changes):
+    """Queue changes for the trigger. Starts a process to run it unless one
+    is running for changes that are waiting. Changes left by a process
+    that died are run with the new ones"""
+    path = pending_path(data_file)
+    with QUEUE_LOCK, locks.InterProcessReaderWriterLock(path + '.lck').write_lock():
+        waiting = os.path.exists(path)
+        if waiting and not runner_running(data_file):
+            LOGGER.debug('Trigger for %r stopped before running queued changes', data_file)
+            waiting = False
+        with open(path, 'a') as stream:
+            stream.write(summary(changes))
+
+        if not waiting:
+            start_runner(data_file, settings['trigger'], float(settings.get('trigger-debounce') or DEBOUNCE))
+
+def start_runner(data_file, command, debounce):
+    import subprocess
+    LOGGER.debug('Starting trigger for %r', data_file)
+    # Collect runners that have finished, which a server would otherwise keep as zombies
+    for pid, process in list(RUNNERS.items()):
+        if process.poll() is not None:
+            del RUNNERS[pid]
+
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'clidigraph.trigger', data_file, command, str(debounce)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+    RUNNERS[process.pid] = process
+    with open(runner_path(data_file), 'w') as stream:
+        stream.write(str(process.pid))
+
+def runner_running(data_file):
+    "Whether the last process started to run the trigger for data_file is still running"
+    try:
+        with open(runner_path(data_file)) as stream:
+            pid = int(stream.read())
+    except (FileNotFoundError, ValueError):
+        return False
+
+    if pid in RUNNERS:
+        return RUNNERS[pid].poll() is None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def take(data_file):
+    "Remove the queued changes and return their summary, or None if there are none"
+    path = pending_path(data_file)
+    with QUEUE_LOCK, locks.InterProcessReaderWriterLock(path + '.lck').write_lock():
+        if not os.path.exists(path):
+            return None
+        with open(path) as stream:
+            lines = stream.read()
+        os.unlink(path)
+    return summary([json.loads(line) for line in lines.splitlines()])
+
+def wait_for_quiet(path, debounce):
+    "Wait until nothing has been written to path for debounce seconds"
+    while True:
+        try:
+            quiet = time.time() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            return
+        if quiet >= debounce:
+            return
+        time.sleep(debounce - quiet)
+
+def run_queued(data_file, command, debounce):
+    """Run the trigger once for the changes queued for data_file.
+
+    Waits for any trigger already running for the graph to finish.
+    Output goes to a log file next to the graph"""
+    import subprocess
+    with locks.InterProcessReaderWriterLock(pending_path(data_file) + '.run').write_lock():
+        wait_for_quiet(pending_path(data_file), debounce)
+        changes = take(data_file)
+        if changes is None:
+            return
+        with open(log_path(data_file), 'w') as log:
+            subprocess.run(
+                command, shell=True, input=changes, universal_newlines=True,
+                stdout=log, stderr=subprocess.STDOUT, env=environment(data_file))
+
+def main():
+    data_file, command, debounce = sys.argv[1:]
+    run_queued(data_file, command, float(debounce))
+
+if __name__ == '__main__':
+    main()
@@ -32,6 +32,6 @@ setuptools.setup(
     classifiers=[
         "License :: OSI Approved :: GNU Lesser General Public License v3 (LGPLv3)"
     ],
-    test_suite='nose.collector',
-    install_requires=['graphviz', 'fasteners', 'python-editor']
+    test_suite='tests',
+    install_requires=['python-editor']
 )
@@ -0,0 +1,188 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from clidigraph import clidigraph, server, trigger
+
+EDGES = [('one', 'two'), ('two', 'three'), ('three', 'one'), ('three', 'four'), ('five', 'four'), ('six', 'five')]
+
+
+def wait_until(predicate, timeout=10):
+    "Wait for predicate to be true, failing after timeout seconds"
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('Timed out waiting for {}'.format(predicate))
+        time.sleep(0.05)
+
+
+class CommandTest(unittest.TestCase):
+    "Commands run through main as they would be from the shell"
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_file = os.path.realpath(os.path.join(self.directory, 'graph'))
+        self.command('node', *sorted(set(node for edge in EDGES for node in edge)))
+        for source, target in EDGES:
+            self.command('edge', source, target)
+        self.command('node', 'seven')
+        self.command('tag', 'seven', 'start', '--new')
+
+    def tearDown(self):
+        clidigraph.RESIDENT.clear()
+        shutil.rmtree(self.directory)
+
+    def command(self, *argv, server=False):
+        "The output of a command"
+        options = ['--config-dir', self.directory] + ([] if server else ['--no-server'])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertFalse(clidigraph.main(options + list(argv)))
+        return output.getvalue()
+
+    def dump(self):
+        return json.loads(self.command('dump'))
+
+    def set_trigger(self, mode):
+        "Make the trigger append the changes it is given, except to settings, to a file"
+        self.command('config', '--set', 'trigger-mode', mode)
+        self.command('config', '--set', 'trigger-debounce', '0.1')
+        self.command('config', '--set', 'trigger', 'grep -v set_setting >> {} || true'.format(self.changes_file))
+        self.wait_for_trigger()
+
+    @property
+    def changes_file(self):
+        return os.path.join(self.directory, 'changes')
+
+    def triggered_changes(self):
+        try:
+            with open(self.changes_file) as stream:
+                return [json.loads(line) for line in stream]
+        except FileNotFoundError:
+            return []
+
+    def wait_for_trigger(self):
+        "Wait for an asynchronous trigger to run all queued changes"
+        wait_until(lambda: not (
+            os.path.exists(trigger.pending_path(self.data_file)) or trigger.runner_running(self.data_file)))
+
+    def test_batch(self):
+        batch_file = os.path.join(self.directory, 'batch')
+        with open(batch_file, 'w') as stream:
+            stream.write('edge one four\nnode eight --from one\n')
+        self.command('batch', batch_file)
+        self.assertEqual(self.command('show', '--after', 'one'), self.command('show', '--after', 'one', '--no-label', 'x'))
+        self.assertIn('eight', self.command('nodes', 'after:one'))
+        self.assertIn('four', self.command('nodes', 'after:one'))
+
+    def test_failed_batch_is_rolled_back(self):
+        self.set_trigger('sync')
+        expected = self.dump()
+        batch_file = os.path.join(self.directory, 'batch')
+        with open(batch_file, 'w') as stream:
+            stream.write('node eight\nedge one eight\nrename two deux\nnoedge one four\nnode nine\n')
+        with self.assertRaisesRegex(Exception, 'Line 4'):
+            self.command('batch', batch_file)
+        self.assertEqual(self.dump(), expected)
+        self.assertEqual(self.triggered_changes(), [])
+
+    def test_jobs(self):
+        "Specifiers evaluated in parallel give the same output"
+        self.command('config', '--set', 'query-cache-size', '0')
+        arguments = [
+            'show', '--highlight', 'strict-after:one,strict-after:five', '--group', 'late', 'after:three',
+            '--before', 'four', '--after', 'tag:start', '--between', 'six', 'four']
+        expected = self.command(*arguments)
+        self.assertIn('late', expected)
+        self.assertEqual(self.command(*arguments + ['--jobs', '3']), expected)
+
+    def test_watch(self):
+        "Output is written again each time a change alters it"
+        expected = [self.command('show', '--after', 'one')]
+        changes = [
+            ('edge', 'four', 'seven'),
+            # Changes that leave the output the same
+            ('config', '--set', 'unused', 'yes'),
+            ('edge', 'six', 'one'),
+            ('tag', 'four', 'start'),
+        ]
+
+        def wait_for_change(data_file, _signature):
+            self.assertEqual(data_file, self.data_file)
+            if not changes:
+                raise KeyboardInterrupt()
+            change = changes.pop(0)
+            before = self.command('show', '--after', 'one')
+            self.command(*change)
+            after = self.command('show', '--after', 'one')
+            if after != before:
+                expected.append(after)
+
+        output = io.StringIO()
+        with unittest.mock.patch.object(clidigraph, 'wait_for_change', wait_for_change):
+            with contextlib.redirect_stdout(output):
+                clidigraph.main(['--config-dir', self.directory, 'show', '--watch', '--after', 'one'])
+        self.assertEqual(len(expected), 3)
+        self.assertEqual(output.getvalue(), ''.join(expected))
+
+    def test_server(self):
+        "Commands sent to a server give the same output and change the same graph"
+        process = subprocess.Popen(
+            [sys.executable, '-c', 'from clidigraph.clidigraph import main; main()', '--config-dir', self.directory, 'serve'],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        try:
+            path = server.socket_path(self.data_file)
+            wait_until(lambda: server.request_possible(path))
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(server.request(self.data_file, ['--config-dir', self.directory, 'nodes']), 0)
+            for argv in (['show'], ['nodes', 'after:one'], ['show', '--between', 'one', 'four']):
+                self.assertEqual(self.command(*argv, server=True), self.command(*argv))
+
+            self.command('edge', 'four', 'seven', server=True)
+            self.command('rename', 'six', 'sixty', server=True)
+            self.assertEqual(self.command('show', server=True), self.command('show'))
+            self.assertIn('sixty', self.command('nodes'))
+
+            # Changes made without the server are seen by it
+            self.command('nonode', 'five')
+            self.assertEqual(self.command('nodes', server=True), self.command('nodes'))
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(10)
+        self.assertFalse(os.path.exists(path))
+
+    def test_trigger(self):
+        self.set_trigger('sync')
+        self.command('edge', 'one', 'four')
+        self.command('trigger')
+        self.assertEqual(self.triggered_changes(), [['add_edge', 'one', 'default', 'four'], ['rewrite']])
+
+    def test_async_trigger(self):
+        self.set_trigger('async')
+        self.command('edge', 'one', 'four')
+        self.command('node', 'eight')
+        self.wait_for_trigger()
+        self.assertEqual(self.triggered_changes(), [['add_edge', 'one', 'default', 'four'], ['add_node', 'eight']])
+
+    def test_async_trigger_after_runner_died(self):
+        "Changes left by a trigger process that died are run after the next change"
+        self.set_trigger('async')
+        self.command('config', '--set', 'trigger-debounce', '60')
+        self.command('edge', 'one', 'four')
+        with open(trigger.runner_path(self.data_file)) as stream:
+            os.kill(int(stream.read()), signal.SIGKILL)
+        wait_until(lambda: not trigger.runner_running(self.data_file))
+        self.assertTrue(os.path.exists(trigger.pending_path(self.data_file)))
+
+        self.command('config', '--set', 'trigger-debounce', '0.1')
+        self.command('node', 'eight')
+        self.wait_for_trigger()
+        self.assertEqual(self.triggered_changes(), [['add_edge', 'one', 'default', 'four'], ['add_node', 'eight']])
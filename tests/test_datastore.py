@@ -0,0 +1,234 @@
+import copy
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from clidigraph import datastore, graphs, journal
+
+
+class TagIndexTest(unittest.TestCase):
+    "Operations on a freshly loaded graph, whose indexes are built when they are first used"
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.directory, 'graph')
+        data = datastore.GraphData(nodes=[], edges=dict(), node_info=dict(), tags=dict(), settings=dict())
+        for node in ('a', 'b'):
+            datastore.add_node(data, node)
+        datastore.create_tag(data, 'start')
+        datastore.add_node_tag(data, 'a', 'start')
+        datastore.set_node_info(data, 'a', 'tag', 'foo')
+        datastore.JsonStore(self.data_file).write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        return datastore.JsonStore(self.data_file).read()
+
+    def test_untag(self):
+        data = self.read()
+        datastore.remove_node_tag(data, 'a', 'start')
+        self.assertEqual(datastore.tagged(data).nodes('start'), set())
+        self.assertEqual(data['node_info']['a']['tags'], [])
+
+    def test_rename(self):
+        data = self.read()
+        datastore.rename_node(data, 'a', 'c')
+        self.assertEqual(datastore.tagged(data).nodes('start'), {'c'})
+        self.assertEqual(datastore.tagged(data).nodes_with_value('foo'), {'c'})
+
+    def test_tag(self):
+        data = self.read()
+        datastore.add_node_tag(data, 'b', 'start')
+        self.assertEqual(datastore.tagged(data).nodes('start'), {'a', 'b'})
+
+    def test_set_node_info(self):
+        data = self.read()
+        datastore.set_node_info(data, 'a', 'tag', 'bar')
+        self.assertEqual(datastore.tagged(data).nodes_with_value('foo'), set())
+        self.assertEqual(datastore.tagged(data).nodes_with_value('bar'), {'a'})
+
+    def test_remove_node(self):
+        data = self.read()
+        datastore.remove_node(data, 'a')
+        self.assertEqual(datastore.tagged(data).nodes('start'), set())
+        self.assertEqual(datastore.tagged(data).nodes_with_value('foo'), set())
+
+
+def new_data():
+    return datastore.GraphData(nodes=[], edges=dict(), node_info=dict(), tags=dict(), settings=dict())
+
+def copy_data(data):
+    "A copy of data without its indexes"
+    return datastore.GraphData(copy.deepcopy(dict(data)))
+
+def random_operations(rand, data, count):
+    """Yield (name, args) for count operations that can be applied to data.
+    data must be changed by each operation before the next is made"""
+    names = (name for name in ('n{}'.format(i) for i in itertools.count()) if name not in data['nodes'])
+    tags = (tag for tag in ('t{}'.format(i) for i in itertools.count()) if tag not in data['tags'])
+    for _ in range(count):
+        nodes = list(data['nodes'])
+        edges = [(source, label, target) for source in data['edges'] for label, target in data['edges'][source]]
+        choices = [('add_node', (next(names),)), ('create_tag', (next(tags),))]
+        if nodes:
+            node = rand.choice(nodes)
+            choices += [
+                ('add_edge', (node, rand.choice(['default', 'x']), rand.choice(nodes))),
+                ('add_edge', (node, 'default', node)),
+                ('remove_node', (node,)),
+                ('rename_node', (node, next(names))),
+                ('set_node_info', (node, 'tag', rand.choice(['foo', 'bar', None]))),
+                ('set_node_info', (node, 'note', 'a note'))]
+            if data['tags']:
+                tag = rand.choice(sorted(data['tags']))
+                choices += [('add_node_tag', (node, tag)), ('remove_node_tag', (node, tag))]
+        if edges:
+            choices.append(('remove_edge', rand.choice(edges)))
+        if data['tags']:
+            tag = rand.choice(sorted(data['tags']))
+            choices += [('rename_tag', (tag, next(tags))), ('delete_tag', (tag,))]
+        yield rand.choice(choices)
+
+def without_empty(index):
+    return {key: set(values) for key, values in index.items() if values}
+
+def build_indexes(data):
+    "Build every maintained index, including trigrams"
+    graphs.predecessors(data)
+    datastore.tagged(data)
+    graphs.names(data)
+    for _ in range(graphs.NameIndex.TRIGRAM_SEARCHES):
+        graphs.names(data).search('n1')
+    graphs.get_index(data, 'reachability', graphs.Reachability.build)
+
+
+class OperationsTest(unittest.TestCase):
+    "Indexes kept up to date by operations are the same as indexes built from the changed data"
+    def assert_indexes_rebuilt(self, data, message):
+        rebuilt = copy_data(data)
+        self.assertEqual(without_empty(graphs.predecessors(data)), without_empty(graphs.predecessors(rebuilt)), message)
+
+        tagged, rebuilt_tagged = datastore.tagged(data), datastore.tagged(rebuilt)
+        self.assertEqual(without_empty(tagged.tags), without_empty(rebuilt_tagged.tags), message)
+        self.assertEqual(without_empty(tagged.values), without_empty(rebuilt_tagged.values), message)
+
+        names = graphs.names(data)
+        self.assertEqual(set(names.names), set(data['nodes']), message)
+        self.assertEqual(sorted(names.search('n1')), sorted(node for node in data['nodes'] if 'n1' in node), message)
+
+        if 'reachability' in data.indexes:
+            reachability = data.indexes['reachability']
+            rebuilt_reachability = graphs.Reachability.build(rebuilt)
+            for node in data['nodes']:
+                self.assertEqual(reachability.strictly_after([node]), rebuilt_reachability.strictly_after([node]), message)
+                self.assertEqual(reachability.strictly_before([node]), rebuilt_reachability.strictly_before([node]), message)
+
+    def test_operations(self):
+        rand = random.Random(0)
+        indexed = new_data()
+        for name, args in random_operations(rand, indexed, 500):
+            message = '{}{!r}'.format(name, args)
+            fresh = copy_data(indexed)
+            build_indexes(indexed)
+
+            getattr(datastore, name)(indexed, *args)
+            getattr(datastore, name)(fresh, *args)
+            self.assertEqual(dict(fresh), dict(indexed), message)
+            self.assert_indexes_rebuilt(indexed, message)
+            self.assert_indexes_rebuilt(fresh, message)
+
+    def test_changes_are_recorded(self):
+        data = new_data()
+        datastore.add_node(data, 'a')
+        datastore.add_edge(data, 'a', 'default', 'a')
+        self.assertEqual(data.changes, [['add_node', 'a'], ['add_edge', 'a', 'default', 'a']])
+
+        replayed = new_data()
+        datastore.replay(replayed, data.changes)
+        self.assertEqual(dict(replayed), dict(data))
+
+
+def plain_data(data):
+    """The contents of data in a form that can be compared between stores.
+    sqlite keeps the position of a renamed edge or tag, and does not keep empty lists of tags"""
+    return dict(
+        nodes=sorted(data['nodes']),
+        edges={source: sorted(edges) for source, edges in data['edges'].items() if edges},
+        node_info={
+            node: {key: sorted(value) if key == 'tags' else value for key, value in info.items() if value != []}
+            for node, info in data['node_info'].items() if info and info != dict(tags=[])},
+        tags=dict(data['tags']),
+        settings=dict(data['settings']))
+
+
+class StoreTest(unittest.TestCase):
+    "Data is the same after it is saved and read again"
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.directory, 'graph')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_round_trip(self, storage, steps=20, operations_per_step=10):
+        rand = random.Random(storage)
+        expected = new_data()
+        datastore.set_setting(expected, 'storage', storage)
+        datastore.store_for_settings(self.data_file, expected['settings']).write(expected)
+
+        for _ in range(steps):
+            store = datastore.open_store(self.data_file)
+            data = store.read()
+            self.assertEqual(plain_data(data), plain_data(expected))
+            for name, args in random_operations(rand, expected, operations_per_step):
+                getattr(datastore, name)(expected, *args)
+                getattr(datastore, name)(data, *args)
+            self.assertFalse(store.save(data))
+            if isinstance(data, datastore.SqliteGraphData):
+                data.connection.close()
+
+        data = datastore.open_store(self.data_file).read()
+        self.assertEqual(plain_data(data), plain_data(expected))
+        return data
+
+    def test_json(self):
+        self.check_round_trip('json')
+        self.assertFalse(os.path.exists(journal.journal_path(self.data_file)))
+
+    def test_journal(self):
+        self.check_round_trip('journal')
+        self.assertTrue(os.path.exists(journal.journal_path(self.data_file)))
+
+    def test_sqlite(self):
+        data = self.check_round_trip('sqlite')
+        data.connection.close()
+
+    def test_json_cache(self):
+        "Data is read from the cache once it is written"
+        self.check_round_trip('json', steps=2)
+        os.unlink(self.data_file + '.cache')
+        first = datastore.JsonStore(self.data_file).read()
+        self.assertTrue(os.path.exists(self.data_file + '.cache'))
+        second = datastore.JsonStore(self.data_file).read()
+        self.assertEqual(dict(first), dict(second))
+
+    def test_migrate(self):
+        "Changing the storage setting moves data to another store"
+        data = self.check_round_trip('json', steps=2)
+        expected = plain_data(data)
+        for storage in ('sqlite', 'journal', 'json'):
+            store = datastore.open_store(self.data_file)
+            data = store.read()
+            datastore.set_setting(data, 'storage', storage)
+            expected['settings']['storage'] = storage
+            store.save(data)
+            if isinstance(data, datastore.SqliteGraphData):
+                data.connection.close()
+            data = datastore.open_store(self.data_file).read()
+            self.assertEqual(plain_data(data), expected, storage)
+            if isinstance(data, datastore.SqliteGraphData):
+                data.connection.close()
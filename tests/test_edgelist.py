@@ -0,0 +1,49 @@
+import io
+import unittest
+
+from clidigraph import datastore, edgelist
+
+NAMES = ['a', 'b c', 'tab\there', 'new\nline', 'cr\rhere', 'crlf\r\nhere', 'ends\r', 'back\\slash', '\\r', 'q"uote', 'co,mma', 'café']
+
+
+def example_graph(names):
+    edges = dict()
+    for i, name in enumerate(names):
+        label = 'label\r' if i % 2 else 'default'
+        edges[name] = {(label, names[(i + 1) % len(names)]): None}
+    return datastore.GraphData(nodes=list(names), edges=edges, node_info=dict(), tags=dict(), settings=dict())
+
+
+class EdgeListTest(unittest.TestCase):
+    def round_trip(self, data, file_format):
+        output = io.StringIO(newline='')
+        edgelist.write_graph(data, output, file_format)
+        items = list(edgelist.read_items(io.StringIO(output.getvalue(), newline=''), file_format))
+        nodes = sorted(item[1] for item in items if item[0] == 'node')
+        edges = sorted(item[1:] for item in items if item[0] == 'edge')
+        return nodes, edges
+
+    def assert_round_trip(self, data, file_format):
+        nodes, edges = self.round_trip(data, file_format)
+        self.assertEqual(nodes, sorted(data['nodes']), file_format)
+        self.assertEqual(edges, sorted(
+            (source, label, target) for source in data['edges'] for label, target in data['edges'][source]), file_format)
+
+    def test_round_trip(self):
+        for file_format in edgelist.FORMATS:
+            self.assert_round_trip(example_graph(NAMES), file_format)
+
+    def test_empty_names(self):
+        for file_format in ('csv', 'jsonl', 'dot'):
+            self.assert_round_trip(example_graph(NAMES + ['']), file_format)
+
+    def test_tsv_empty_name(self):
+        with self.assertRaises(ValueError):
+            edgelist.write_graph(example_graph(NAMES + ['']), io.StringIO(), 'tsv')
+
+    def test_import(self):
+        data = example_graph(NAMES[:2])
+        added = edgelist.import_items(data, [('node', 'a'), ('node', 'c'), ('edge', 'a', 'default', 'b'), ('edge', 'c', 'x', 'd')])
+        self.assertEqual(added, (3, 2))
+        self.assertEqual(data['edges']['c'], {('x', 'd'): None})
+        self.assertIsNone(data.changes)
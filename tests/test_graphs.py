@@ -0,0 +1,210 @@
+import functools
+import itertools
+import random
+import re
+import unittest
+
+from benchmarks import contract
+from clidigraph import graphs
+
+NAMES = [
+    '', 'a', 'Azzz', 'azzz', 'abc', 'abcabc', 'a.b', 'a+b', 'x{2}', 'tab\there', 'new\nline',
+    'café', 'café au lait', '\U0001f600smile', 'A1', '01zzz', '41zzz', 'zzz', 'aaab', 'hello world']
+
+PATTERNS = [
+    r'\x41zzz', r'\101zzz', r'é au', r'\U0001f600smi', r'\N{LATIN SMALL LETTER E WITH ACUTE} au',
+    r'(a)\1ab', r'(abc)\1', r'\0', r'a\.b', r'a\+b', r'x\{2\}', r'tab\there', r'new\nline', r'\ther',
+    r'abc', r'ab?c', r'a{3}b', r'a{2,}b', r'[ab]zzz', r'[^b]zzz', r'\dzzz', r'\bzzz', r'zz+', r'(ab)*c',
+    r'^abc$', r'hello\sworld', r'a|zzz', r'(?i)azzz', r'.zzz', r'\Azzz\Z']
+
+# Tokens for generating patterns
+TOKENS = ['a', 'b', 'z', 'A', '1', '.', '\\.', '?', '*', '+', '{2}', '\\x41', '\\x7a', '\\101', '\\d', '[az]', '(z)', '\\1']
+
+
+class NameIndexTest(unittest.TestCase):
+    def assert_search_like_re(self, index, pattern):
+        expected = sorted(name for name in NAMES if re.search(pattern, name))
+        self.assertEqual(sorted(index.search(pattern)), expected, pattern)
+
+    def test_search_matches_re(self):
+        index = graphs.names(graphs.Graph(nodes=list(NAMES), edges=dict()))
+        # Searches after the first few use trigrams
+        for pattern in PATTERNS * graphs.NameIndex.TRIGRAM_SEARCHES:
+            self.assert_search_like_re(index, pattern)
+        self.assertIsNotNone(index.trigrams)
+
+    def test_generated_patterns_match_re(self):
+        index = graphs.names(graphs.Graph(nodes=list(NAMES), edges=dict()))
+        rand = random.Random(0)
+        for _ in range(2000):
+            pattern = ''.join(rand.choice(TOKENS) for _ in range(rand.randint(1, 6)))
+            try:
+                re.compile(pattern)
+            except re.error:
+                continue
+            self.assert_search_like_re(index, pattern)
+
+    def test_search_after_changes(self):
+        index = graphs.names(graphs.Graph(nodes=list(NAMES), edges=dict()))
+        for pattern in PATTERNS:
+            index.search(pattern)
+        index.add('Bzzz')
+        index.remove('Azzz')
+        self.assertEqual(sorted(index.search('zzz')), sorted(
+            name for name in itertools.chain(NAMES, ['Bzzz']) if 'zzz' in name and name != 'Azzz'))
+
+    def test_required_literals(self):
+        self.assertEqual(graphs.required_literals(r'\x41zzz'), ['zzz'])
+        self.assertEqual(graphs.required_literals(r'\101zzz'), ['zzz'])
+        self.assertEqual(graphs.required_literals(r'ab?cd\.e'), ['a', 'cd.e'])
+        self.assertEqual(graphs.required_literals(r'a|b'), [])
+
+
+def random_graph(rand, size, edge_count):
+    "A graph of size nodes with up to edge_count edges, including loops"
+    nodes = ['n{}'.format(i) for i in range(size)]
+    edges = dict()
+    for _ in range(edge_count):
+        edges.setdefault(rand.choice(nodes), set()).add((rand.choice([graphs.DEFAULT, 'x']), rand.choice(nodes)))
+    return graphs.Graph(nodes=nodes, edges={source: sorted(pairs) for source, pairs in edges.items()})
+
+def reverse_edges(graph):
+    "target -> [(label, source), ...]"
+    result = dict()
+    for source, pairs in graph['edges'].items():
+        for label, target in pairs:
+            result.setdefault(target, []).append((label, source))
+    return result
+
+def distances(edges, roots):
+    "The number of steps from the nearest root to each node reached, following edges"
+    result = dict.fromkeys(roots, 0)
+    border = list(result)
+    while border:
+        new_border = []
+        for node in border:
+            for _, target in edges.get(node, []):
+                if target not in result:
+                    result[target] = result[node] + 1
+                    new_border.append(target)
+        border = new_border
+    return result
+
+def normal_form(graph):
+    "A graph without the order of nodes and edges, or sources without edges"
+    return sorted(set(graph['nodes'])), sorted(
+        (source, sorted(map(tuple, pairs))) for source, pairs in graph['edges'].items() if pairs)
+
+def search_after(graph, roots, depth=None):
+    "The graph after roots found by a search from each node"
+    found = distances(graph['edges'], roots)
+    return graphs.Graph(
+        nodes=[node for node, distance in found.items() if depth is None or distance <= depth],
+        edges={
+            node: list(graph['edges'].get(node, []))
+            for node, distance in found.items() if depth is None or distance < depth})
+
+def search_before(graph, roots, depth=None):
+    "The graph before roots found by a search from each node"
+    reverse = reverse_edges(graph)
+    found = distances(reverse, roots)
+    edges = dict()
+    for node, distance in found.items():
+        if depth is None or distance < depth:
+            for label, source in reverse.get(node, []):
+                edges.setdefault(source, []).append((label, node))
+    return graphs.Graph(nodes=[node for node, distance in found.items() if depth is None or distance <= depth], edges=edges)
+
+def search_strictly(edges, roots):
+    "Nodes reached from a root other than themselves"
+    result = set()
+    for root in roots:
+        result.update(node for node in distances(edges, [root]) if node != root)
+    return result
+
+def search_between(graph, from_nodes, to_nodes):
+    nodes = distances(graph['edges'], from_nodes).keys() & distances(reverse_edges(graph), to_nodes).keys()
+    return graphs.Graph(nodes=nodes, edges={
+        source: [(label, target) for label, target in graph['edges'].get(source, []) if target in nodes]
+        for source in nodes})
+
+def merge_graph_pair(a, b):
+    "The previous merge_graphs, applied to each pair of graphs in turn"
+    result = graphs.Graph(nodes=[], edges=dict())
+    result['nodes'] = list(sorted(set(itertools.chain(a['nodes'], b['nodes']))))
+
+    for source in set.union(set(a['edges']), set(b['edges'])):
+        result['edges'][source] = list(set.union(
+            set(map(tuple, a['edges'].get(source, list()))),
+            set(map(tuple, b['edges'].get(source, list())))))
+
+    return result
+
+
+class TraversalTest(unittest.TestCase):
+    "Searches are the same as a search from each root of small random graphs"
+    def graphs(self, count=300):
+        rand = random.Random(0)
+        for _ in range(count):
+            size = rand.randint(1, 12)
+            graph = random_graph(rand, size, rand.randint(0, 3 * size))
+            names = graph['nodes'] + ['missing']
+            yield rand, graph, lambda: set(rand.sample(names, rand.randint(1, min(3, len(names)))))
+
+    def test_after_and_before(self):
+        for rand, graph, sample in self.graphs():
+            roots = sample()
+            depth = rand.choice([None, 0, 1, 2])
+            message = (graph, roots, depth)
+            self.assertEqual(
+                normal_form(graphs.after_graphs(graph, roots, depth)),
+                normal_form(search_after(graph, roots, depth)), message)
+            self.assertEqual(
+                normal_form(graphs.before_graphs(graph, roots, depth)),
+                normal_form(search_before(graph, roots, depth)), message)
+
+    def test_strictly(self):
+        for _, graph, sample in self.graphs():
+            roots = sample()
+            self.assertEqual(graphs.strictly_after(graph, roots), search_strictly(graph['edges'], roots), (graph, roots))
+            self.assertEqual(
+                graphs.strictly_before(graph, roots), search_strictly(reverse_edges(graph), roots), (graph, roots))
+
+    def test_between(self):
+        for _, graph, sample in self.graphs():
+            from_nodes, to_nodes = sample(), sample()
+            self.assertEqual(
+                normal_form(graphs.between_graph(graph, from_nodes, to_nodes)),
+                normal_form(search_between(graph, from_nodes, to_nodes)), (graph, from_nodes, to_nodes))
+
+    def test_reachability_index(self):
+        "Queries answered by the reachability index, before and after it is saved"
+        for _, graph, sample in self.graphs():
+            graph['settings'] = {'reachability-index': 'yes'}
+            saved = graphs.Reachability(*graphs.Reachability.build(graph).to_tuple())
+            for _ in range(3):
+                from_nodes, to_nodes = sample(), sample()
+                message = (graph, from_nodes, to_nodes)
+                self.assertEqual(
+                    normal_form(graphs.between_graph(graph, from_nodes, to_nodes)),
+                    normal_form(search_between(graph, from_nodes, to_nodes)), message)
+                self.assertEqual(graphs.strictly_after(graph, from_nodes), search_strictly(graph['edges'], from_nodes), message)
+                self.assertEqual(
+                    graphs.strictly_before(graph, from_nodes), search_strictly(reverse_edges(graph), from_nodes), message)
+                self.assertEqual(saved.between(from_nodes, to_nodes), graphs.reachability(graph).between(from_nodes, to_nodes))
+            self.assertIn('reachability', graph.indexes)
+
+    def test_merge(self):
+        for rand, graph, _ in self.graphs(100):
+            parts = [graphs.after_graph(graph, rand.choice(graph['nodes'])) for _ in range(rand.randint(1, 4))]
+            merged, expected = graphs.merge_graphs(*parts), functools.reduce(merge_graph_pair, parts)
+            self.assertEqual(normal_form(merged), normal_form(expected))
+            # Nodes are sorted, unless there is a single graph
+            self.assertEqual(list(merged['nodes']), list(expected['nodes']))
+
+    def test_contract(self):
+        for rand, graph, _ in self.graphs():
+            kept = set(rand.sample(graph['nodes'], rand.randint(0, len(graph['nodes']))))
+            self.assertEqual(
+                contract.normal_form(graphs.contract_graph(graph, kept)),
+                contract.normal_form(contract.contract_by_search(graph, kept)), (graph, kept))
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from clidigraph import querycache
+
+
+class QueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = querycache.QueryCache(os.path.join(self.directory, 'graph'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get('v1', 'key'))
+        self.cache.put('v1', 'key', ['value'], querycache.CACHE_SIZE)
+        self.assertEqual(self.cache.get('v1', 'key'), ['value'])
+        self.assertIsNone(self.cache.get('v2', 'key'))
+        self.assertIsNone(self.cache.get('v1', 'other'))
+
+    def test_other_code_versions_are_not_used(self):
+        self.cache.put('v1', 'key', ['value'], querycache.CACHE_SIZE)
+        with unittest.mock.patch.object(querycache, 'code_version', lambda: 'upgraded'):
+            self.assertIsNone(self.cache.get('v1', 'key'))
+        self.assertEqual(self.cache.get('v1', 'key'), ['value'])
+
+    def test_least_recently_used_are_evicted(self):
+        value = 'x' * 1000
+        for key in ('a', 'b', 'c'):
+            self.cache.put('v1', key, value, querycache.CACHE_SIZE)
+        # Modification times order entries
+        for age, key in enumerate(('c', 'a', 'b')):
+            path = self.cache.path('v1', key)
+            os.utime(path, ns=(age, age))
+        self.cache.get('v1', 'c')
+
+        entries, size = self.cache.stats()
+        self.cache.evict(size * 2 // 3)
+        self.assertIsNone(self.cache.get('v1', 'a'))
+        self.assertEqual(self.cache.get('v1', 'b'), value)
+        self.assertEqual(self.cache.get('v1', 'c'), value)
+        self.assertEqual(self.cache.stats()[0], entries - 1)
+
+    def test_clear(self):
+        self.cache.put('v1', 'key', 1, querycache.CACHE_SIZE)
+        self.cache.clear()
+        self.assertEqual(self.cache.stats(), (0, 0))
+        self.assertIsNone(self.cache.get('v1', 'key'))
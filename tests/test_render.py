@@ -0,0 +1,148 @@
+import random
+import unittest
+
+from clidigraph import graphs, render
+
+try:
+    import graphviz
+except ImportError:
+    graphviz = None
+
+NAMES = [
+    'a', 'b c', 'node', 'Graph', 'strict', '1', '-1.5', '.5', '1.', '1a', '_x', 'x-y', 'café', '',
+    'say "hi"', '"', 'a"b\\"c', '\\"q', 'back\\slash', 'tab\there', 'new\nline']
+
+TAGS = ['t1', 't2', 'edge']
+
+
+def render_with_graphviz(data, graph, highlighted_nodes, grouped_nodes):
+    "The previous render_graph, which built a graphviz object"
+    rendered_nodes = set()
+    graphviz_graph = graphviz.Digraph()
+
+    def render_node(name):
+        node_info = data['node_info'].get(name, dict())
+
+        tags = node_info.get('tags')
+
+        tag = sorted(tags)[0] if tags else None
+        kwargs = dict()
+
+        if tag:
+            kwargs["tooltip"] = 'tag:' + tag
+        else:
+            kwargs["tooltip"] = ''
+
+        if name in (set.union(*grouped_nodes.values()) if grouped_nodes else set()):
+            for group_name, nodes in grouped_nodes.items():
+                if name in nodes:
+                    kwargs["fillcolor"] = render.get_tag_color(group_name, grouped_nodes, data)
+                    kwargs["style"] = 'filled'
+                    break
+        elif name in highlighted_nodes:
+            kwargs["fillcolor"] = render.HIGHLIGHT_COLOR
+            kwargs["style"] = 'filled'
+        elif tag:
+            kwargs["fillcolor"] = render.get_tag_color(tag, grouped_nodes, data)
+            kwargs["style"] = 'filled'
+
+        if name in highlighted_nodes:
+            kwargs["tooltip"] += '\nhighlighted\n'
+
+        if name in (set.union(*grouped_nodes.values()) if grouped_nodes else set()):
+            for group_name, nodes in grouped_nodes.items():
+                if name in nodes:
+                    kwargs["tooltip"] += '\ngroup:' + group_name
+
+        if node_info.get('note', None):
+            kwargs['peripheries'] = '2'
+
+        return graphviz_graph.node(name, **kwargs)
+
+    for node in graph['nodes']:
+        if node not in rendered_nodes:
+            rendered_nodes.add(node)
+            render_node(node)
+
+    for source in graph['edges']:
+        if source not in rendered_nodes:
+            rendered_nodes.add(source)
+            render_node(source)
+
+        for (label, target) in graph['edges'][source]:
+
+            if target not in rendered_nodes:
+                rendered_nodes.add(target)
+                render_node(target)
+
+            if label == graphs.DEFAULT:
+                graphviz_graph.edge(source, target)
+            elif label == graphs.IMPLICIT:
+                graphviz_graph.edge(source, target, style='dashed')
+            else:
+                graphviz_graph.edge(source, target, label=label)
+
+    return graphviz_graph.source
+
+def random_render_arguments(rand):
+    "Data, a graph, highlighted nodes and groups to render"
+    nodes = rand.sample(NAMES, rand.randint(1, 8))
+    tags = rand.sample(TAGS, rand.randint(0, 2))
+    data = dict(node_info=dict(), tags={tag: [] for tag in tags})
+    for node in nodes:
+        info = dict()
+        if tags and rand.random() < 0.5:
+            info['tags'] = rand.sample(tags, rand.randint(1, len(tags)))
+        if rand.random() < 0.3:
+            info['note'] = 'a note'
+        data['node_info'][node] = info
+
+    edges = dict()
+    for _ in range(rand.randint(0, 8)):
+        label = rand.choice([graphs.DEFAULT, graphs.IMPLICIT, 'a label', 'say "x"'])
+        edges.setdefault(rand.choice(nodes), []).append((label, rand.choice(NAMES)))
+
+    groups = {
+        group: set(rand.sample(nodes, rand.randint(0, len(nodes))))
+        for group in rand.sample(['g1', 'g2'], rand.randint(0, 2))}
+    highlighted = set(rand.sample(nodes, rand.randint(0, min(2, len(nodes)))))
+    return data, graphs.Graph(nodes=nodes, edges=edges), highlighted, groups
+
+
+class RenderTest(unittest.TestCase):
+    @unittest.skipIf(graphviz is None, 'graphviz is not installed')
+    def test_same_as_graphviz(self):
+        "Names without colons, which graphviz split into node and port in edges"
+        rand = random.Random(0)
+        for _ in range(300):
+            arguments = random_render_arguments(rand)
+            self.assertEqual(render.render_graph(*arguments), render_with_graphviz(*arguments), arguments)
+
+    def test_render_lines(self):
+        rand = random.Random(0)
+        for _ in range(100):
+            arguments = random_render_arguments(rand)
+            lines = list(render.render_lines(*arguments))
+            self.assertEqual(''.join(lines), render.render_graph(*arguments))
+            self.assertEqual(lines[0], 'digraph {\n')
+            self.assertEqual(lines[-1], '}\n')
+
+    def test_render(self):
+        data = dict(node_info={'a': dict(tags=['t1'], note='note'), 'b:c': dict()}, tags={'t1': []})
+        graph = graphs.Graph(nodes=['a'], edges={'a': [(graphs.DEFAULT, 'b:c'), (graphs.IMPLICIT, 'a'), ('x y', 'a')]})
+        self.assertEqual(render.render_graph(data, graph, {'b:c'}, dict()), (
+            'digraph {\n'
+            '\ta [fillcolor=pink peripheries=2 style=filled tooltip="tag:t1"]\n'
+            '\t"b:c" [fillcolor=yellow style=filled tooltip="\nhighlighted\n"]\n'
+            '\ta -> "b:c"\n'
+            '\ta -> a [style=dashed]\n'
+            '\ta -> a [label="x y"]\n'
+            '}\n'))
+
+    def test_dot_quote(self):
+        for identifier, expected in [
+                ('a', 'a'), ('_a1', '_a1'), ('1.5', '1.5'), ('-.5', '-.5'), ('1.', '1.'),
+                ('1a', '"1a"'), ('', '""'), ('a b', '"a b"'), ('node', '"node"'), ('Digraph', '"Digraph"'),
+                ('b:c', '"b:c"'), ('café', '"café"'), ('say "hi"', '"say \\"hi\\""'), ('\\"', '"\\""'),
+                ('\\\\"', '"\\\\\\""'), ('back\\slash', '"back\\slash"'), ('new\nline', '"new\nline"')]:
+            self.assertEqual(render.dot_quote(identifier), expected, identifier)